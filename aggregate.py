@@ -0,0 +1,312 @@
+import dataclasses
+import datetime
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.holiday import USFederalHolidayCalendar as calendar
+
+import episodes
+
+OFFSET = datetime.datetime(1900,1,1,0,0,0)
+
+
+@dataclasses.dataclass(frozen=True)
+class BunchThreshold:
+    """Headways under `seconds` are bunched, or under `fraction` of the scheduled headway if set."""
+    seconds: float = 120
+    fraction: float = None
+
+    @classmethod
+    def parse(cls, text):
+        # "120" is seconds; "0.25H" or "25%" is a fraction of the scheduled headway
+        text = text.strip()
+        if text.upper().endswith("H"):
+            return cls(fraction=float(text[:-1]))
+        if text.endswith("%"):
+            return cls(fraction=float(text[:-1]) / 100)
+        return cls(seconds=float(text))
+
+    def label(self):
+        if self.fraction is not None:
+            return f"< H*{self.fraction:g}"
+        return f"< {self.seconds / 60:g}min"
+
+    def describe(self):
+        if self.fraction is not None:
+            return f"less than {self.fraction:.0%} of the scheduled headway"
+        minutes = self.seconds / 60
+        return f"less than {minutes:g} minute{'' if minutes == 1 else 's'}"
+
+# Set from --bunch-threshold; every bunched flag in the reports and the store uses it
+THRESHOLD = BunchThreshold()
+
+# Bunching percents come with a Wilson interval at this z (95%), and are flagged
+# as sparse below MIN_SAMPLE headways (set from --min-sample)
+Z = 1.96
+MIN_SAMPLE = 30
+
+# The notebook's HeadwayCategories after the bunched one, relative to the scheduled headway H
+HEADWAY_CATEGORIES = ["< H-2", "< H+2", "< H*1.5", "< H*2", "> H*2"]
+
+
+@dataclasses.dataclass
+class Aggregates:
+    by_timepoint: pd.DataFrame  # time_point_id -> bunches, total, percent
+    by_day: pd.DataFrame        # service_date x time_point_id -> bunches, total, percent
+    by_hour: pd.DataFrame       # weekday x departure_hour x stop -> bunches, total, Percent
+    headways: pd.DataFrame = None  # time_point_id x hour x category -> count
+    episodes: pd.DataFrame = None  # one row per bunching episode, see episodes.find
+
+
+def is_bunched(data, threshold=None):
+    threshold = threshold or THRESHOLD
+    if threshold.fraction is not None:
+        return data["headway"] < data["scheduled_headway"] * threshold.fraction
+    return data["headway"] < threshold.seconds
+
+def headway_categories(threshold=None):
+    return [(threshold or THRESHOLD).label()] + HEADWAY_CATEGORIES
+
+def categorize_headways(data, threshold=None):
+    """Bin each headway against its scheduled headway H, as the notebook's calc_headway_category.
+
+    Rows without a headway or scheduled headway get no category.
+    """
+    headway = data["headway"].to_numpy()
+    scheduled = data["scheduled_headway"].to_numpy()
+    conditions = [
+        is_bunched(data, threshold).to_numpy(),
+        headway < scheduled - 120,
+        headway < scheduled + 120,
+        headway < scheduled * 1.5,
+        headway < scheduled * 2,
+        ~np.isnan(headway) & ~np.isnan(scheduled),
+    ]
+    codes = np.select(conditions, np.arange(len(conditions)), default=-1)
+    return pd.Categorical.from_codes(codes, categories=headway_categories(threshold), ordered=True)
+
+def headway_distribution(data, keys=("time_point_id", "hour"), threshold=None):
+    """Count headways in each category by `keys`: any of data's columns, or the "hour" of the actual time."""
+    keys = list(keys)
+    columns = {"category": categorize_headways(data, threshold)}
+    if "hour" in keys:
+        columns["hour"] = (data["actual"] - OFFSET) // np.timedelta64(1, 'h')
+    counts = data.assign(**columns).groupby(keys + ["category"], observed=True).size().to_frame("count")
+    counts = counts.reset_index()
+    if "hour" in keys:
+        counts["hour"] = counts["hour"].astype(int)
+    return counts
+
+
+def wilson(bunches, total, z=Z):
+    """Wilson score interval for bunches/total, in percent, for whole arrays of counts at once.
+
+    Cells with no headways get NaN bounds.
+    """
+    bunches = np.asarray(bunches, dtype=float)
+    total = np.asarray(total, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = bunches / total
+        denominator = 1 + z**2 / total
+        center = (p + z**2 / (2 * total)) / denominator
+        half = z * np.sqrt(p * (1 - p) / total + z**2 / (4 * total**2)) / denominator
+    # rounding can push a bound past p when it is exactly 0 or 1, which would make a negative error bar
+    low = np.minimum(np.clip(center - half, 0, 1), p)
+    high = np.maximum(np.clip(center + half, 0, 1), p)
+    return low * 100, high * 100
+
+def with_interval(counts):
+    # 95% bounds, and whether there are too few headways to read much into the percent
+    counts["low"], counts["high"] = wilson(counts["bunches"], counts["total"])
+    counts["sparse"] = counts["total"] < MIN_SAMPLE
+    return counts
+
+def with_percent(counts):
+    counts["percent"] = counts["bunches"] / counts["total"] * 100
+    return with_interval(counts)
+
+def count_bunches(data, keys):
+    # `total` counts events with a headway; bunched rows always have one
+    counts = data.assign(total=data["headway"].notna()) \
+                 .groupby(keys, observed=True)[["bunched", "total"]].sum() \
+                 .rename(columns={"bunched": "bunches"})
+    return counts.astype(int)
+
+def by_day(data):
+    return with_percent(count_bunches(data, ["service_date", "time_point_id"]).reset_index())
+
+def by_timepoint(daily):
+    # roll the daily cube up rather than grouping the raw rows a second time
+    counts = daily.groupby("time_point_id", observed=True)[["bunches", "total"]].sum()
+    return with_percent(counts.reset_index())
+
+def weekdays(ds):
+    holidays = calendar().holidays().date
+    return (ds.dt.day_of_week < 5) & ~ds.isin(holidays)
+
+def stop_rows(data, stop, date_codes, trip_codes, n_trips, keep="first"):
+    """Trip keys, actual times and bunched flags for one stop, one row per trip.
+
+    Rows without an actual time are skipped. A trip that passes the stop twice
+    (e.g. dudly, merged into nubn) keeps its `keep` ("first" or "last") visit.
+    """
+    rows = (data["time_point_id"].to_numpy() == stop) & data["actual"].notna().to_numpy()
+    keys = date_codes[rows] * n_trips + trip_codes[rows]
+    actual = data["actual"].to_numpy()[rows].astype("datetime64[ns]")
+    order = np.lexsort((actual.astype(np.int64), keys))
+    keys = keys[order]
+    once = np.diff(keys, prepend=-1) != 0 if keep == "first" else np.diff(keys, append=-1) != 0
+    order = order[once]
+    return keys[once], actual[order], data["bunched"].to_numpy()[rows][order]
+
+def by_hour(data, first_stop, last_stop):
+    """Percent of trips bunched at the first and last stop, by trip departure hour.
+
+    Trips are matched across the two stops by sorted (service_date, half_trip_id)
+    keys, and counts are accumulated with bincount rather than a pivot/melt.
+    """
+    date_codes, dates = pd.factorize(data["service_date"])
+    trip_codes, trips = pd.factorize(data["half_trip_id"])
+    f_keys, f_actual, f_bunched = stop_rows(data, first_stop, date_codes, trip_codes, len(trips))
+    l_keys, _, l_bunched = stop_rows(data, last_stop, date_codes, trip_codes, len(trips), keep="last")
+
+    # only trips seen at both stops count
+    keys, f_idx, l_idx = np.intersect1d(f_keys, l_keys, assume_unique=True, return_indices=True)
+    # Calculate hour of departure from first stop
+    offset = np.datetime64(OFFSET, "ns").astype(np.int64)
+    hours = (f_actual[f_idx].astype("datetime64[ns]").astype(np.int64) - offset) // 3_600_000_000_000
+    # label business days as weekday
+    is_weekday = weekdays(pd.Series(pd.to_datetime(dates))).to_numpy()
+    weekday = is_weekday[keys // len(trips)].astype(np.int64)
+
+    hmin = hours.min() if len(hours) else 0
+    nhours = hours.max() - hmin + 1 if len(hours) else 0
+    cell = (weekday * nhours + (hours - hmin)) * 2
+    ncells = 2 * nhours * 2
+    totals = np.bincount(cell, minlength=ncells) + np.bincount(cell + 1, minlength=ncells)
+    bunches = np.bincount(cell, weights=f_bunched[f_idx], minlength=ncells) \
+        + np.bincount(cell + 1, weights=l_bunched[l_idx], minlength=ncells)
+
+    seen = np.flatnonzero(totals)
+    stop = seen % 2
+    percents = pd.DataFrame({
+        "weekday": (seen // 2 // nhours).astype(bool),
+        "departure_hour": seen // 2 % nhours + hmin,
+        "stop": np.where(stop == 0, "first", "last"),
+        "bunches": bunches[seen].astype(int),
+        "total": totals[seen],
+        "Percent": bunches[seen] / totals[seen] * 100,
+    })
+    percents["Trip Departure Hour"] = percents["departure_hour"].astype(int)
+    percents["Stop ID"] = np.where(stop == 0, first_stop, last_stop)
+    return with_interval(percents)
+
+def aggregate(data, tpts):
+    """Compute every table the report charts need for one direction's data."""
+    daily = by_day(data)
+    first_stop, last_stop = tpts.time_point_id.iloc[[1, -2]]
+    return Aggregates(by_timepoint=by_timepoint(daily),
+                      by_day=daily,
+                      by_hour=by_hour(data, first_stop, last_stop),
+                      headways=headway_distribution(data),
+                      episodes=episodes.find(data))
+
+def combine(a, b):
+    """Fold two Aggregates (e.g. consecutive months) into one.
+
+    Only the small aggregate tables are concatenated, never the raw rows.
+    Stop IDs in the time of day table are taken from `b`, the later period.
+    """
+    by_timepoint = pd.concat([a.by_timepoint, b.by_timepoint]) \
+        .groupby("time_point_id", observed=True)[["bunches", "total"]].sum().reset_index()
+    by_day = pd.concat([a.by_day, b.by_day]) \
+        .groupby(["service_date", "time_point_id"], observed=True)[["bunches", "total"]].sum().reset_index()
+
+    stop_ids = b.by_hour.groupby("stop")["Stop ID"].first()
+    hourly = pd.concat([a.by_hour, b.by_hour])
+
+    headways = None
+    if a.headways is not None and b.headways is not None:
+        headways = pd.concat([a.headways, b.headways]) \
+            .groupby(["time_point_id", "hour", "category"], observed=True)["count"].sum().reset_index()
+
+    found = None
+    if a.episodes is not None and b.episodes is not None:
+        found = pd.concat([a.episodes, b.episodes], ignore_index=True)
+
+    return Aggregates(by_timepoint=with_percent(by_timepoint),
+                      by_day=with_percent(by_day),
+                      by_hour=hourly_percents(hourly, stop_ids),
+                      headways=headways,
+                      episodes=found)
+
+def hourly_percents(hourly, stop_ids):
+    # sum bunch/total counts into the time of day chart's table
+    hourly = hourly.groupby(["weekday", "departure_hour", "stop"])[["bunches", "total"]].sum().reset_index()
+    hourly["Percent"] = hourly["bunches"] / hourly["total"] * 100
+    hourly["Trip Departure Hour"] = hourly["departure_hour"].astype(int)
+    hourly["Stop ID"] = hourly["stop"].map(stop_ids)
+    return with_interval(hourly)
+
+SYSTEM_KEYS = ["route_id", "direction_id", "time_point_id", "time_point_order", "hour"]
+
+def system_counts(data):
+    """Event, bunch and total counts per route, direction, timepoint and hour of arrival.
+
+    One groupby over every route's rows; chunks of a month can be counted
+    separately and summed. Rows without an actual time get hour -1.
+    """
+    hour = ((data["actual"] - OFFSET) // np.timedelta64(1, 'h')).fillna(-1)
+    counts = data.assign(hour=hour, events=1, total=data["headway"].notna()) \
+                 .groupby(SYSTEM_KEYS, observed=True)[["events", "bunched", "total"]].sum() \
+                 .rename(columns={"bunched": "bunches"})
+    counts = counts.astype(int).reset_index()
+    counts["hour"] = counts["hour"].astype(int)
+    return counts
+
+STORE_KEYS = ["direction_id", "service_date", "time_point_id", "time_point_order", "hour"]
+
+def trip_departure_hours(data):
+    # hour each trip left the first timepoint it has an actual time for
+    origin = data.sort_values("time_point_order") \
+                 .groupby(["service_date", "half_trip_id"])["actual"].transform("first")
+    return (origin - OFFSET) // np.timedelta64(1, 'h')
+
+def store_counts(data):
+    """Event, bunch and total counts keyed by STORE_KEYS, for the persistent aggregate store.
+
+    `hour` is the trip's departure hour from its origin, so every chart table
+    can be rebuilt by summing these rows.
+    """
+    counts = data.assign(hour=trip_departure_hours(data), events=1, total=data["headway"].notna()) \
+                 .groupby(STORE_KEYS, observed=True)[["events", "bunched", "total"]].sum() \
+                 .rename(columns={"bunched": "bunches"})
+    counts = counts.astype(int).reset_index()
+    counts["hour"] = counts["hour"].astype(int)
+    return counts
+
+def from_store(rows, tpts):
+    """Rebuild one direction's Aggregates from store_counts rows.
+
+    Unlike by_hour, a trip counts toward the time of day table at whichever of
+    the first/last stops it was seen, keyed by its origin departure hour.
+    The store keeps no scheduled headways or trips, so there is no headway
+    distribution and there are no episodes.
+    """
+    daily = with_percent(rows.groupby(["service_date", "time_point_id"], observed=True)[["bunches", "total"]]
+                             .sum().reset_index())
+
+    first_stop, last_stop = tpts.time_point_id.iloc[[1, -2]]
+    ends = rows.loc[rows["time_point_id"].isin([first_stop, last_stop])]
+    hourly = pd.DataFrame({
+        "weekday": weekdays(pd.to_datetime(ends["service_date"])).to_numpy(),
+        "departure_hour": ends["hour"].to_numpy(),
+        "stop": np.where(ends["time_point_id"] == first_stop, "first", "last"),
+        "bunches": ends["bunches"].to_numpy(),
+        "total": ends["total"].to_numpy(),
+    })
+    stop_ids = pd.Series({"first": first_stop, "last": last_stop})
+
+    return Aggregates(by_timepoint=by_timepoint(daily),
+                      by_day=daily,
+                      by_hour=hourly_percents(hourly, stop_ids))
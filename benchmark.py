@@ -0,0 +1,125 @@
+import argparse
+import contextlib
+import io
+import json
+import pathlib
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import pandas as pd
+from fpdf import FPDF
+
+import aggregate
+import draw_reports
+import ingest
+import synthetic
+
+
+@contextlib.contextmanager
+def timed(results, stage, repeat, rows=None):
+    start = time.perf_counter()
+    yield
+    results.append({"stage": stage, "repeat": repeat, "seconds": time.perf_counter() - start, "rows": rows})
+
+def use_synthetic_month(workdir, frame):
+    """Point draw_reports and the cache at a synthetic month written under `workdir`."""
+    month = frame["service_date"].iloc[0][:7]
+    csv = workdir / f"synthetic_{month}.csv"
+    synthetic.write(frame, csv, workdir / "checkpoints.txt")
+    draw_reports.DATAFILES[month] = str(csv)
+    draw_reports.CHECKPOINT_FILE = str(workdir / "checkpoints.txt")
+    draw_reports.get_checkpoints.cache_clear()
+    ingest.CACHE_DIR = workdir / "cache"
+    return month
+
+def run(frame, route, repeats):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        month = use_synthetic_month(pathlib.Path(tmp), frame)
+        for repeat in range(repeats):
+            shutil.rmtree(ingest.cache_path(month), ignore_errors=True)
+            with timed(results, "load_data (csv)", repeat, len(frame)):
+                data = draw_reports.load_data(month, route)
+            with timed(results, "ingest", repeat, len(frame)):
+                ingest.build_cache(month, draw_reports.DATAFILES[month])
+            with timed(results, "load_data (cache)", repeat, len(data)):
+                data = draw_reports.load_data(month, route)
+            data["bunched"] = aggregate.is_bunched(data)
+
+            pages = []
+            for direction in draw_reports.DIRECTIONS:
+                onedir_data = data.loc[data["direction_id"] == direction]
+                rows = len(onedir_data)
+                with timed(results, "get_timepoints", repeat, rows):
+                    tpts = draw_reports.get_timepoints(onedir_data)
+                with timed(results, "aggregate", repeat, rows):
+                    aggs = aggregate.aggregate(onedir_data, tpts)
+
+                charts = {name: io.BytesIO() for name in ["overview", "legend", "tod", "cal", "headways", "episodes"]}
+                with timed(results, "draw_overview_chart", repeat, rows):
+                    draw_reports.draw_overview_chart(aggs.by_timepoint, tpts, charts["overview"])
+                with timed(results, "draw_tpt_legend", repeat, rows):
+                    draw_reports.draw_tpt_legend(tpts, charts["legend"])
+                with timed(results, "draw_time_of_day_plots", repeat, rows):
+                    draw_reports.draw_time_of_day_plots(aggs.by_hour, tpts, charts["tod"])
+                with timed(results, "draw_calendar", repeat, rows):
+                    draw_reports.draw_calendar(aggs.by_day, tpts, charts["cal"])
+                with timed(results, "draw_headway_distribution", repeat, rows):
+                    draw_reports.draw_headway_distribution(aggs.headways, tpts, charts["headways"])
+                with timed(results, "draw_episodes", repeat, len(aggs.episodes)):
+                    draw_reports.draw_episodes(aggs.episodes, tpts, charts["episodes"])
+                worst = draw_reports.stringline_days(aggs.by_day)[0]
+                day = onedir_data.loc[onedir_data["service_date"] == worst]
+                charts[f"stringline_{worst}"] = io.BytesIO()
+                with timed(results, "draw_stringline", repeat, len(day)):
+                    draw_reports.draw_stringline(day, tpts, charts[f"stringline_{worst}"])
+                pages.append((direction, tpts, charts))
+                plt.close("all")
+
+            with timed(results, "pdf assembly", repeat, len(data)):
+                pdf = FPDF('P', 'in', 'letter')
+                for direction, tpts, charts in pages:
+                    add_charts = {name: buf for name, buf in charts.items() if name != "legend"}
+                    draw_reports.add_charts_to_pdf(pdf, route, direction, draw_reports.month_label(month),
+                                                   tpts, add_charts)
+                pdf.output(str(pathlib.Path(tmp) / "bench.pdf"))
+    return results
+
+def summarize(results):
+    stages = {}
+    for result in results:
+        stages.setdefault(result["stage"], []).append(result["seconds"])
+    return pd.DataFrame({"median_s": {k: statistics.median(v) for k, v in stages.items()},
+                         "min_s": {k: min(v) for k, v in stages.items()}})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="time each report stage on synthetic data")
+    parser.add_argument("--routes", type=int, default=5)
+    parser.add_argument("--trips", type=int, default=60, help="trips per day per direction")
+    parser.add_argument("--timepoints", type=int, default=8)
+    parser.add_argument("--days", type=int, default=28)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_results.json")
+
+    args = parser.parse_args()
+
+    frame = synthetic.generate(args.routes, args.trips, args.timepoints, args.days, seed=args.seed)
+    results = run(frame, "1", args.repeats)
+
+    with open(args.out, "w") as f:
+        json.dump({
+            "params": vars(args),
+            "environment": {"python": platform.python_version(), "pandas": pd.__version__,
+                            "matplotlib": matplotlib.__version__, "machine": platform.machine()},
+            "results": results,
+        }, f, indent=1)
+    print(summarize(results).to_string(float_format="{:.4f}".format))
+    print("wrote", args.out)
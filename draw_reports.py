@@ -1,31 +1,69 @@
 import argparse
-import datetime
+import concurrent.futures
+import dataclasses
+import functools
+import glob
+import io
+import json
+import logging
+import os
 import pathlib
+import re
+import time
 
 import pandas as pd
-from pandas.tseries.holiday import USFederalHolidayCalendar as calendar
 import numpy as np
 import seaborn as sns
 
 import matplotlib
+import matplotlib.patches
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.collections import LineCollection
 import matplotlib.gridspec as gridspec
 
 from fpdf import FPDF
 
-sns.set(rc={'figure.facecolor':'white', "figure.autolayout": True})
+import aggregate
+import episodes
+import ingest
+import instrument
+import plotting
+import report_cache
+import store
 
+SNS_RC = {'figure.facecolor':'white', "figure.autolayout": True}
+sns.set(rc=SNS_RC)
+
+DIRECTIONS = ["Inbound", "Outbound"]
+
+@dataclasses.dataclass
+class RenderOptions:
+    dump_images: bool = False  # also write every chart to imgs/{route}_{direction}/
+    format: str = "png"        # png, jpg, or svg to embed charts as vector graphics
+    dpi: int = None            # raster resolution, matplotlib's default if unset
+    quality: int = 85          # jpg compression quality
+    stringlines: int = 1       # stringline pages for this many of the worst-bunching days
+    stringline_dates: tuple = ()  # and for these service dates ("YYYY-MM-DD")
+
+OPTIONS = RenderOptions()
+
+# fpdf2 warns about every svg tag it skips (matplotlib's <metadata>, <style>)
+logging.getLogger("fpdf.svg").setLevel(logging.ERROR)
 CHECKPOINT_FILE = "./in-data/MBTA_GTFS/checkpoints.txt"
-DATAFILES = {
-    'January': "./in-data/2022/MBTA_Bus_Arrival_Departure_Times_2022/MBTA-Bus-Arrival-Departure-Times_2022-01.csv",
-    "February": "./in-data/2022/MBTA_Bus_Arrival_Departure_Times_2022/MBTA-Bus-Arrival-Departure-Times_2022-02.csv",
-    'March': "./in-data/2022/MBTA_Bus_Arrival_Departure_Times_2022/MBTA-Bus-Arrival-Departure-Times_2022-03.csv",
-    'April': "./in-data/2022/MBTA_Bus_Arrival_Departure_Times_2022/MBTA-Bus-Arrival-Departure-Times_2022-04.csv",
-    'May': "./in-data/2022/MBTA_Bus_Arrival_Departure_Times_2022/MBTA-Bus-Arrival-Departure-Times_2022-05.csv",
-    'June': "./in-data/2022/MBTA_Bus_Arrival_Departure_Times_2022/MBTA-Bus-Arrival-Departure-Times_2022-06.csv",
-}
+DATA_GLOB = "./in-data/*/MBTA_Bus_Arrival_Departure_Times_*/MBTA-Bus-Arrival-Departure-Times_*.csv"
+
+def discover_datafiles(pattern=DATA_GLOB):
+    """Map each monthly arrival/departure csv matching `pattern` to its "YYYY-MM" month."""
+    files = {}
+    for path in sorted(glob.glob(pattern)):
+        match = re.search(r"(\d{4}-\d{2})\.csv$", path)
+        if match:
+            files[match.group(1)] = path
+    return files
+
+DATAFILES = discover_datafiles()
 
 """
 SCHOOL TRIPS! (could be messing up expected headways)
@@ -43,64 +81,430 @@ One more viz? random stringilne possible, or something else
 (pull out big take-aways in a chart?)
 """
 
-def load_data(filename, route):
-    monthly = pd.read_csv(filename, parse_dates=["scheduled", "actual"])
-    monthly["time_point_id"] = monthly["time_point_id"].str.lower()
-    monthly.loc[monthly["time_point_id"] == "dudly", "time_point_id"] = "nubn"
-    return monthly.loc[monthly["route_id"] == route].copy()
-
-def generate_report(route, month, outname):
-    filename = DATAFILES[month]
-
-    print("loading data...")
-    data = load_data(filename, route)
-    data["bunched"] = data["headway"] < 120
-
+def load_data(month, route, stream=None):
+    # Prefer the parquet cache built by `--ingest`; fall back to the raw csv.
+    # Every path returns the same columns, without route_id, so the render cache keys agree.
+    if ingest.is_cached(month, DATAFILES.get(month)):
+        with instrument.stage("cache read") as record:
+            data = ingest.read_route(month, route)
+            record["rows"] = len(data)
+        return data
+    if stream is not None:
+        # read in chunks with the "pandas" or "pyarrow" engine, keeping only this route
+        with instrument.stage("csv stream") as record:
+            data = ingest.concat_chunks(list(ingest.stream_routes(DATAFILES[month], [route], engine=stream)))
+            data = data.drop(columns="route_id")
+            record["rows"] = len(data)
+        return data
+    with instrument.stage("csv parse") as record:
+        monthly = ingest.read_csv(DATAFILES[month], ingest.REPORT_COLUMNS + ["route_id"])
+        record["rows"] = len(monthly)
+    with instrument.stage("route filter") as record:
+        # take() gathers the route's rows once, without the extra .copy()
+        data = monthly.take(np.flatnonzero(monthly["route_id"].to_numpy() == route)).drop(columns="route_id")
+        data = ingest.prepare(data)
+        record["rows"] = len(data)
+    return data
+
+def load_month(month, columns=ingest.REPORT_COLUMNS + ["route_id"]):
+    """Every route's rows for a month, from the parquet cache if it has been built."""
+    if ingest.is_cached(month, DATAFILES.get(month)):
+        return pd.read_parquet(ingest.cache_path(month), columns=columns)
+    return ingest.prepare(ingest.read_csv(DATAFILES[month], columns))
+
+def write_episodes(month, routes=None, outname=None):
+    """Find the bunching episodes of every route (or just `routes`) in a month and write them to csv."""
+    data = load_month(month)
+    if routes:
+        data = data.loc[data["route_id"].isin(routes)]
+    data["bunched"] = aggregate.is_bunched(data)
+    with instrument.stage("episodes", len(data)):
+        found = episodes.find(data)
+    outname = outname or f"episodes_{month}.csv"
+    found.to_csv(outname, index=False)
+    print(f"{len(found)} episodes ->", outname)
+    return found
+
+def system_counts(month):
+    """aggregate.system_counts over a whole month, streaming the csv in chunks if there is no cache."""
+    if ingest.is_cached(month, DATAFILES.get(month)):
+        chunks = [load_month(month)]
+    else:
+        chunks = ingest.stream_routes(DATAFILES[month])
+    parts = []
+    for chunk in chunks:
+        with instrument.stage("system counts", len(chunk)):
+            chunk["bunched"] = aggregate.is_bunched(chunk)
+            parts.append(aggregate.system_counts(chunk))
+    counts = pd.concat(parts, ignore_index=True).astype({"route_id": str, "direction_id": str, "time_point_id": str})
+    return counts.groupby(aggregate.SYSTEM_KEYS)[["events", "bunches", "total"]].sum().reset_index()
+
+def system_ranking(counts):
+    """Rank every route and direction by percent bunched, over get_timepoints' timepoints less the terminals.
+
+    Returns the ranking and the counts kept, with their percent.
+    """
+    # find_timepoints for every route and direction at once: each timepoint seen over 100 times,
+    # at its most common order, then all but the first and last in order
+    routes = ["route_id", "direction_id"]
+    tpts = counts.groupby(routes + ["time_point_id", "time_point_order"])["events"].sum().reset_index()
+    tpts = tpts.loc[tpts["events"] > 100].sort_values("events", ascending=False, kind="stable") \
+               .drop_duplicates(routes + ["time_point_id"]).sort_values(routes + ["time_point_order"])
+    position = tpts.groupby(routes).cumcount()
+    tpts = tpts.loc[(position > 0) & (position < tpts.groupby(routes)["events"].transform("size") - 1)]
+    detail = aggregate.with_percent(counts.merge(tpts[routes + ["time_point_id"]], on=routes + ["time_point_id"]))
+
+    def worst(key):
+        # the key value with the highest percent bunched, per route and direction
+        by_key = aggregate.with_percent(detail.groupby(["route_id", "direction_id", key])[["bunches", "total"]]
+                                              .sum().reset_index())
+        # prefer cells with enough headways to mean something
+        by_key = by_key.sort_values(["sparse", "percent"], ascending=[True, False], kind="stable")
+        return by_key.drop_duplicates(["route_id", "direction_id"]).set_index(["route_id", "direction_id"])[key]
+
+    ranking = aggregate.with_percent(detail.groupby(["route_id", "direction_id"])[["bunches", "total"]].sum())
+    ranking["worst_time_point"] = worst("time_point_id")
+    ranking["worst_hour"] = worst("hour")
+    ranking = ranking.sort_values("percent", ascending=False, kind="stable").reset_index()
+    ranking.insert(0, "rank", np.arange(1, len(ranking) + 1))
+    return ranking, detail
+
+def generate_system_summary(month, outname=None, top=30):
+    """Rank every route in the month by bunching: a csv of the ranking, a csv of the counts, and a pdf page."""
+    start = time.perf_counter()
+    outname = outname or f"system_{month}"
+    ranking, detail = system_ranking(system_counts(month))
+    ranking.to_csv(f"{outname}.csv", index=False)
+    detail.to_csv(f"{outname}_detail.csv", index=False)
+
+    chart = io.BytesIO()
+    draw_system_ranking(ranking.head(top), chart)
     pdf = FPDF('P', 'in', 'letter')
-    for direction in ["Inbound", "Outbound"]:
-        imgdir = pathlib.Path(f"imgs/{route}_{direction}/")
-        imgdir.mkdir(exist_ok=True)
-
-        onedir_data = data.loc[data["direction_id"] == direction].copy()
-        timepoints = get_timepoints(onedir_data)
-
-        print("drawing charts:", direction)
-        draw_charts(onedir_data, timepoints, imgdir)
-        print("adding to pdf:", direction)
-        add_charts_to_pdf(pdf, route, direction, month, timepoints, imgdir)
-
-    pdf.output(outname, "F")
-    print("done.")
-
-
-def draw_charts(data, tpts, imgdir):
-    draw_overview_chart(data, tpts, imgdir/"overview.png")
-    draw_tpt_legend(tpts, imgdir/"legend.png")
-    draw_time_of_day_plots(data, tpts, imgdir/"tod.png")
-    draw_calendar(data, tpts, imgdir/"cal.png")
-
-def add_charts_to_pdf(pdf, route, direction, month, tpts, imgdir):
+    add_system_page(pdf, month_label(month), ranking.head(top), chart)
+    return finish_report(pdf, f"{outname}.pdf", start)
+
+def month_label(month):
+    return pd.Period(month, freq="M").strftime("%B %Y")
+
+def parse_month(text):
+    # "YYYY-MM"; anything pd.Period can't read as a month is a ValueError, which argparse reports
+    return str(pd.Period(text, freq="M"))
+
+def months_between(start, end):
+    return [str(p) for p in pd.period_range(start, end, freq="M")]
+
+def report_name(route, month):
+    return f"{route}_{pd.Period(month, freq='M').strftime('%B%y')}.pdf"
+
+def finish_report(pdf, outname, start):
+    """Write the pdf, free its figures, and report its size and render time."""
+    pdf.output(outname)
+    plt.close("all")
+    size = pathlib.Path(outname).stat().st_size
+    seconds = time.perf_counter() - start
+    print(f"done. {outname}: {size / 1024:.0f} KiB in {seconds:.1f}s ({OPTIONS.format}, dpi={OPTIONS.dpi or 'default'})")
+    return size, seconds
+
+def generate_report(route, month, outname, data=None):
+    start = time.perf_counter()
+    with instrument.labels(route=route, month=month):
+        if data is None:
+            print("loading data...")
+            data = load_data(month, route)
+        key = report_key(data)
+        if fetch_report(key, outname):
+            return finish_cached(outname, start)
+        data["bunched"] = aggregate.is_bunched(data)
+
+        pdf = FPDF('P', 'in', 'letter')
+        for direction in DIRECTIONS:
+            timepoints, charts = render_direction(data, route, direction, month)
+            print("adding to pdf:", direction)
+            with instrument.labels(direction=direction), instrument.stage("pdf assembly"):
+                add_charts_to_pdf(pdf, route, direction, month_label(month), timepoints, charts)
+
+        with instrument.stage("pdf output"):
+            result = finish_report(pdf, outname, start)
+        report_cache.store(key, outname)
+        return result
+
+def report_key(data):
+    """Hash of everything a route's report is drawn from, for the render cache."""
+    with instrument.stage("report key", len(data)):
+        return report_cache.report_key(data, CHECKPOINT_FILE, aggregate.THRESHOLD, aggregate.MIN_SAMPLE, OPTIONS)
+
+def fetch_report(key, outname):
+    # dumping chart images needs a real render
+    return not OPTIONS.dump_images and report_cache.fetch(key, outname)
+
+def finish_cached(outname, start):
+    size = pathlib.Path(outname).stat().st_size
+    seconds = time.perf_counter() - start
+    print(f"unchanged. {outname}: {size / 1024:.0f} KiB copied from the render cache in {seconds:.1f}s")
+    return size, seconds
+
+def chart_dump_dir(route, direction):
+    if not OPTIONS.dump_images:
+        return None
+    imgdir = pathlib.Path(f"imgs/{route}_{direction}/")
+    # parallel jobs may race to create imgs/ itself
+    imgdir.mkdir(parents=True, exist_ok=True)
+    return imgdir
+
+def direction_slice(data, direction):
+    """One direction's rows, as a view when they are contiguous (as the cache returns them)."""
+    positions = np.flatnonzero(data["direction_id"].to_numpy() == direction)
+    if len(positions) and positions[-1] - positions[0] + 1 == len(positions):
+        return data.iloc[positions[0]:positions[-1] + 1]
+    return data.take(positions)
+
+def render_direction(data, route, direction, month):
+    with instrument.labels(route=route, direction=direction, month=month):
+        imgdir = chart_dump_dir(route, direction)
+        onedir_data = direction_slice(data, direction)
+        rows = len(onedir_data)
+        with instrument.stage("timepoints", rows):
+            timepoints = get_timepoints(onedir_data, (month, route, direction))
+        with instrument.stage("aggregate", rows):
+            aggs = aggregate.aggregate(onedir_data, timepoints)
+
+        print("drawing charts:", route, direction)
+        charts = draw_charts(aggs, timepoints, imgdir, data=onedir_data)
+    return timepoints, charts
+
+def generate_all_reports(month, routes=None, engine="pandas"):
+    """Render every route (or just `routes`) for a month from a single pass over the data."""
+    if ingest.is_cached(month, DATAFILES.get(month)):
+        # partitions are already split by route, so each report reads only its own
+        for route in routes or ingest.cached_routes(month):
+            print("route", route)
+            generate_report(route, month, report_name(route, month))
+        return
+
+    print("splitting", month, "by route...")
+    for route, data in ingest.split_routes(DATAFILES[month], routes, engine):
+        print("route", route)
+        generate_report(route, month, report_name(route, month), data)
+        # free each route's frame once its report is written, before the next is built
+        del data
+
+def available_months():
+    # months with a csv, or with only a cache
+    return sorted(set(DATAFILES) | {p.name for p in ingest.CACHE_DIR.glob("????-??") if ingest.is_cached(p.name, None)})
+
+def range_months(start, end):
+    # months in the range that have data, either a csv or a cache
+    return [m for m in months_between(start, end) if m in DATAFILES or ingest.is_cached(m, None)]
+
+def generate_range_report(route, start, end, outname):
+    """Report on `route` over every month from `start` to `end` ("YYYY-MM").
+
+    Months are loaded one at a time and folded into running per-direction
+    aggregates, so memory stays flat however long the range is. The calendar
+    page is only drawn for single-month ranges. Months and directions the
+    route doesn't run in are skipped.
+    """
+    start_time = time.perf_counter()
+    months = range_months(start, end)
+    if not months:
+        raise ValueError(f"no data for any month from {start} to {end}")
+    folded = {}
+    folded_months = []
+    for month in months:
+        if ingest.is_cached(month, DATAFILES.get(month)) and route not in ingest.cached_routes(month):
+            print("no rows for", route, "in", month)
+            continue
+        data = load_data(month, route)
+        if not len(data):
+            print("no rows for", route, "in", month)
+            continue
+        print("folding", month)
+        folded_months.append(month)
+        data["bunched"] = aggregate.is_bunched(data)
+        for direction in DIRECTIONS:
+            onedir_data = data.loc[data["direction_id"] == direction]
+            if not len(onedir_data):
+                continue
+            counts = timepoint_counts(onedir_data)
+            aggs = aggregate.aggregate(onedir_data, get_timepoints(onedir_data, (month, route, direction)))
+            if direction in folded:
+                prev_counts, prev_aggs = folded[direction]
+                counts = prev_counts.add(counts, fill_value=0)
+                aggs = aggregate.combine(prev_aggs, aggs)
+            folded[direction] = (counts, aggs)
+        del data
+    if not folded:
+        raise ValueError(f"no rows for route {route} in any month from {start} to {end}")
+
+    period = f"{month_label(folded_months[0])} - {month_label(folded_months[-1])}"
+    single_month = len(folded_months) == 1
+    pdf = FPDF('P', 'in', 'letter')
+    for direction in DIRECTIONS:
+        if direction not in folded:
+            continue
+        counts, aggs = folded[direction]
+        timepoints = find_timepoints(None, counts)
+        timepoints["name"] = timepoints["time_point_id"].map(get_checkpoints())
+        imgdir = chart_dump_dir(route, direction)
+        print("drawing charts:", route, direction)
+        charts = draw_charts(aggs, timepoints, imgdir, calendar=single_month)
+        add_charts_to_pdf(pdf, route, direction, period, timepoints, charts)
+
+    return finish_report(pdf, outname, start_time)
+
+def generate_store_report(route, month, outname):
+    """Render a month's report from the persistent aggregate store instead of raw rows."""
+    start = time.perf_counter()
+    rows = store.read(route, month)
+    pdf = FPDF('P', 'in', 'letter')
+    for direction in DIRECTIONS:
+        onedir_rows = rows.loc[rows["direction_id"] == direction]
+        counts = onedir_rows.groupby(["time_point_id", "time_point_order"])["events"].sum().to_frame("counts")
+        timepoints = find_timepoints(None, counts)
+        timepoints["name"] = timepoints["time_point_id"].map(get_checkpoints())
+        aggs = aggregate.from_store(onedir_rows, timepoints)
+
+        imgdir = chart_dump_dir(route, direction)
+        print("drawing charts:", route, direction)
+        charts = draw_charts(aggs, timepoints, imgdir)
+        add_charts_to_pdf(pdf, route, direction, month_label(month), timepoints, charts)
+
+    return finish_report(pdf, outname, start)
+
+
+@dataclasses.dataclass
+class JobResult:
+    route: str
+    month: str
+    ok: bool
+    seconds: float
+    size: int = None
+    error: str = None
+
+def init_worker(options, metrics=None, threshold=None, min_sample=None):
+    global OPTIONS
+    # each worker gets its own pyplot state; never try to open a window
+    matplotlib.use("Agg")
+    sns.set(rc=SNS_RC)
+    OPTIONS = options
+    instrument.JSONL_PATH = metrics
+    aggregate.THRESHOLD = threshold or aggregate.THRESHOLD
+    aggregate.MIN_SAMPLE = min_sample or aggregate.MIN_SAMPLE
+
+def render_job(route, month):
+    # a whole route per job: the worker loads it once, checks the render cache, and writes the pdf itself
+    start = time.perf_counter()
+    try:
+        size, _ = generate_report(route, month, report_name(route, month))
+        return JobResult(route, month, True, time.perf_counter() - start, size)
+    except Exception as e:
+        return JobResult(route, month, False, time.perf_counter() - start, error=repr(e))
+    finally:
+        plt.close("all")
+
+def generate_reports_parallel(month, routes=None, workers=None):
+    """Render each route's report in its own job across a process pool.
+
+    Workers read their route's partition from the parquet cache, so the month is
+    ingested first if needed. Each worker checks the render cache and assembles
+    its own pdf, so the parent only hands out routes. Returns the per-route results.
+    """
+    if not ingest.is_cached(month, DATAFILES.get(month)):
+        print("ingesting", month, "...")
+        ingest.build_cache(month, DATAFILES[month])
+    routes = routes or ingest.cached_routes(month)
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                                initargs=(OPTIONS, instrument.JSONL_PATH, aggregate.THRESHOLD,
+                                                          aggregate.MIN_SAMPLE)) as pool:
+        futures = [pool.submit(render_job, route, month) for route in routes]
+        for future in concurrent.futures.as_completed(futures):
+            job = future.result()
+            results.append(job)
+            print(f"{job.route}: {'ok' if job.ok else 'FAILED'} in {job.seconds:.1f}s", job.error or "")
+
+    failed = [job for job in results if not job.ok]
+    print(f"{len(results) - len(failed)}/{len(results)} routes succeeded,",
+          f"{sum(job.seconds for job in results):.1f}s total render time")
+    return results
+
+
+def stringline_days(by_day):
+    """OPTIONS.stringline_dates that have data, then the days with the most bunches."""
+    dates = [d for d in OPTIONS.stringline_dates if d in set(by_day["service_date"])]
+    bunches = by_day.groupby("service_date", observed=True)["bunches"].sum()
+    worst = bunches.drop(dates).sort_values(ascending=False, kind="stable").index[:OPTIONS.stringlines]
+    return dates + sorted(worst)
+
+def draw_charts(aggs, tpts, imgdir=None, calendar=True, data=None):
+    """Render the report charts into in-memory PNG buffers, keyed by chart name.
+
+    Stringlines need the raw rows, so they are only drawn when `data` is given.
+    If `imgdir` is given, the charts (and the timepoint legend) are also
+    written there for debugging.
+    """
+    charts = {"overview": io.BytesIO(), "tod": io.BytesIO()}
+    with instrument.stage("draw_overview_chart", len(aggs.by_timepoint)):
+        draw_overview_chart(aggs.by_timepoint, tpts, charts["overview"])
+    with instrument.stage("draw_time_of_day_plots", len(aggs.by_hour)):
+        draw_time_of_day_plots(aggs.by_hour, tpts, charts["tod"])
+    if calendar:
+        charts["cal"] = io.BytesIO()
+        with instrument.stage("draw_calendar", len(aggs.by_day)):
+            draw_calendar(aggs.by_day, tpts, charts["cal"])
+    if aggs.headways is not None:
+        charts["headways"] = io.BytesIO()
+        with instrument.stage("draw_headway_distribution", len(aggs.headways)):
+            draw_headway_distribution(aggs.headways, tpts, charts["headways"])
+    if aggs.episodes is not None:
+        charts["episodes"] = io.BytesIO()
+        with instrument.stage("draw_episodes", len(aggs.episodes)):
+            draw_episodes(aggs.episodes, tpts, charts["episodes"])
+    if data is not None:
+        for date in stringline_days(aggs.by_day):
+            day = data.loc[data["service_date"] == date]
+            charts[f"stringline_{date}"] = io.BytesIO()
+            with instrument.stage("draw_stringline", len(day)):
+                draw_stringline(day, tpts, charts[f"stringline_{date}"])
+
+    if imgdir is not None:
+        draw_tpt_legend(tpts, imgdir/f"legend.{OPTIONS.format}")
+        for name, buf in charts.items():
+            (imgdir/f"{name}.{OPTIONS.format}").write_bytes(buf.getvalue())
+    return charts
+
+def save_chart(fig, out):
+    kwargs = {"format": OPTIONS.format, "dpi": OPTIONS.dpi or "figure"}
+    if OPTIONS.format == "jpg":
+        kwargs["pil_kwargs"] = {"quality": OPTIONS.quality}
+    fig.savefig(out, **kwargs)
+
+def add_charts_to_pdf(pdf, route, direction, period, tpts, charts):
     pdf.add_page()
     
     # TITLE
-    pdf.set_font('Arial', 'B', 16)
+    pdf.set_font('Helvetica', 'B', 16)
     pdf.cell(0, .4, f"Route {route} - {direction}",
              border='B', align='L')
-    pdf.cell(0, 0.4, f"{month} 2022",
+    pdf.cell(0, 0.4, period,
              border=0, align='R')
     pdf.ln(0.5)
 
     # Description
-    pdf.set_font("Arial", '', 9)
+    pdf.set_font("Helvetica", '', 9)
     pdf.multi_cell(4.5, 0.2,
         "The following charts show bunching events as a pecentage of total trips. " + 
-        "Here, bunching is defined as headways that are less than 2 minutes.",
+        f"Here, bunching is defined as headways that are {aggregate.THRESHOLD.describe()}. " +
+        "Error bars are 95% Wilson intervals; faded, dash-outlined bars rest on fewer than " +
+        f"{aggregate.MIN_SAMPLE} headways. On the calendar, a caret marks an interval that runs past " +
+        "the top of its day.",
         )
     pdf.ln(0.25)
 
     # Overview
     row1y = pdf.get_y()
-    pdf.image(str(imgdir/"overview.png"), w=3.5)
+    pdf.image(charts["overview"], w=3.5)
     pdf.ln(0.25)
     cal_pos = (pdf.get_x(), pdf.get_y())
 
@@ -108,7 +512,7 @@ def add_charts_to_pdf(pdf, route, direction, month, tpts, imgdir):
     tblx = 4.5
     pdf.set_xy(tblx, row1y + 0.25)
     table = tpts[["time_point_order", "time_point_id", "name"]]
-    pdf.set_font('Arial', '', 8)
+    pdf.set_font('Helvetica', '', 8)
     c0w = 0.14
     c1w = 0.5
     c2w = 3
@@ -127,45 +531,170 @@ def add_charts_to_pdf(pdf, route, direction, month, tpts, imgdir):
 
 
     pdf.set_xy(*cal_pos)
-    pdf.image(str(imgdir/"cal.png"), w=7.5)
+    if "cal" in charts:
+        pdf.image(charts["cal"], w=7.5)
     # TODO: smaller charts/bigger text
 
-    pdf.image(str(imgdir/"tod.png"), w=7)
+    pdf.image(charts["tod"], w=7)
     # TODO: legend outside? wider, not as tall?
 
+    if "headways" in charts:
+        add_headway_page(pdf, route, direction, period, charts["headways"])
+    if "episodes" in charts:
+        add_episode_page(pdf, route, direction, period, charts["episodes"])
+    for name in sorted(charts):
+        if name.startswith("stringline_"):
+            add_stringline_page(pdf, route, direction, name.split("_", 1)[1], charts[name])
+
+def add_headway_page(pdf, route, direction, period, chart):
+    pdf.add_page()
+    pdf.set_font('Helvetica', 'B', 16)
+    pdf.cell(0, .4, f"Route {route} - {direction}: Headways",
+             border='B', align='L')
+    pdf.cell(0, 0.4, period,
+             border=0, align='R')
+    pdf.ln(0.5)
+
+    pdf.set_font("Helvetica", '', 9)
+    pdf.multi_cell(7, 0.2,
+        "Every headway, compared to its scheduled headway H (in minutes), by timepoint and by hour " +
+        f"of arrival. The first category is bunching: headways {aggregate.THRESHOLD.describe()}.",
+        )
+    pdf.ln(0.25)
+    pdf.image(chart, w=7.5)
+
+def add_system_page(pdf, period, ranking, chart):
+    pdf.add_page()
+    pdf.set_font('Helvetica', 'B', 16)
+    pdf.cell(0, .4, "System Summary", border='B', align='L')
+    pdf.cell(0, 0.4, period, border=0, align='R')
+    pdf.ln(0.5)
+
+    pdf.set_font("Helvetica", '', 9)
+    pdf.multi_cell(7, 0.2,
+        f"The {len(ranking)} route directions with the highest share of bunched headways " +
+        f"({aggregate.THRESHOLD.describe()}), over each route's timepoints except the terminals.",
+        )
+    pdf.ln(0.2)
+    pdf.image(chart, w=7.5)
+    pdf.ln(0.1)
+
+    pdf.set_font('Helvetica', 'B', 8)
+    h = 0.15
+    widths = [0.4, 0.8, 0.9, 0.8, 0.8, 0.8, 1.2, 0.9]
+    headers = ["Rank", "Route", "Direction", "Percent", "Bunches", "Headways", "Worst timepoint", "Worst hour"]
+    for w, header in zip(widths, headers):
+        pdf.cell(w, h, header, align="C", border=1)
+    pdf.ln(h)
+    pdf.set_font('Helvetica', '', 8)
+    for row in ranking.itertuples():
+        values = [row.rank, row.route_id, row.direction_id, f"{row.percent:.1f}%", row.bunches, row.total,
+                  row.worst_time_point, f"{row.worst_hour}:00"]
+        for w, value in zip(widths, values):
+            pdf.cell(w, h, str(value), align="C", border=1)
+        pdf.ln(h)
+
+def add_episode_page(pdf, route, direction, period, chart):
+    pdf.add_page()
+    pdf.set_font('Helvetica', 'B', 16)
+    pdf.cell(0, .4, f"Route {route} - {direction}: Bunching Episodes",
+             border='B', align='L')
+    pdf.cell(0, 0.4, period,
+             border=0, align='R')
+    pdf.ln(0.5)
+
+    pdf.set_font("Helvetica", '', 9)
+    pdf.multi_cell(7, 0.2,
+        "An episode is one pair of buses that stays bunched over consecutive timepoints. " +
+        "These charts show where episodes start and end, and how many timepoints they last.",
+        )
+    pdf.ln(0.25)
+    pdf.image(chart, w=7.5)
+
+def add_stringline_page(pdf, route, direction, date, chart):
+    pdf.add_page()
+    pdf.set_font('Helvetica', 'B', 16)
+    pdf.cell(0, .4, f"Route {route} - {direction}: Stringline",
+             border='B', align='L')
+    pdf.cell(0, 0.4, pd.Timestamp(date).strftime("%A, %B %d %Y"),
+             border=0, align='R')
+    pdf.ln(0.5)
 
+    pdf.set_font("Helvetica", '', 9)
+    pdf.multi_cell(7, 0.2,
+        "Every trip's path through the timepoints over the day. Red trips ran closer than scheduled " +
+        "to the bus ahead on average, blue trips further apart; bunched buses show as converging lines.",
+        )
+    pdf.ln(0.25)
+    pdf.image(chart, w=7.5)
+
+
+@functools.lru_cache(maxsize=None)
 def get_checkpoints():
     return pd.read_csv(CHECKPOINT_FILE).set_index("checkpoint_id").squeeze()
 
 
-def get_timepoints(data):
-    all_timepoints = data[["time_point_id", "time_point_order"]].value_counts().to_frame("counts")
+def timepoint_counts(data):
+    return data[["time_point_id", "time_point_order"]].value_counts().to_frame("counts")
+
+def find_timepoints(data, all_timepoints=None):
+    if all_timepoints is None:
+        all_timepoints = timepoint_counts(data)
     filtered_timepoints = all_timepoints.loc[all_timepoints["counts"] > 100].groupby("time_point_id").idxmax()["counts"].tolist()
-    timepoints = pd.DataFrame(filtered_timepoints, columns=["time_point_id", "time_point_order"]).sort_values(by="time_point_order").reset_index(drop=True)
+    return pd.DataFrame(filtered_timepoints, columns=["time_point_id", "time_point_order"]).sort_values(by="time_point_order").reset_index(drop=True)
+
+def timepoint_index_path(month, route, direction):
+    return ingest.CACHE_DIR / "timepoints" / month / f"{route}_{direction}.json"
+
+def cached_timepoints(data, key):
+    """find_timepoints(data), memoized on disk per (month, route, direction).
+
+    Entries are stamped with the month's source file signature, so a new or
+    updated data file invalidates them.
+    """
+    month = key[0]
+    source = ingest.source_signature(DATAFILES.get(month), month)
+    path = timepoint_index_path(*key)
+    if path.exists():
+        entry = json.loads(path.read_text())
+        if entry["source"] == source:
+            return pd.DataFrame(entry["timepoints"], columns=["time_point_id", "time_point_order"])
+
+    timepoints = find_timepoints(data)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    entry = {"source": source, "timepoints": timepoints.values.tolist()}
+    # write-then-rename so parallel workers never read a partial file
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(entry))
+    os.replace(tmp, path)
+    return timepoints
+
+def get_timepoints(data, key=None):
+    timepoints = find_timepoints(data) if key is None else cached_timepoints(data, key)
     chks = get_checkpoints()
     timepoints["name"] = timepoints["time_point_id"].map(chks)
     return timepoints
     # order = timepoints["time_point_id"][1:-1]
 
-def draw_overview_chart(data, tpts, outname):
-    # Count bunches and total by timepoint, calculate percents
-    bunches = data.loc[data.bunched].groupby("time_point_id")["headway"].count()
-    all_events = data.groupby("time_point_id")["headway"].count()
-    metric = pd.concat([bunches, all_events], axis=1).reset_index()
-    metric.columns = ["time_point_id", "bunches", "total"]
-    metric["percent"] = metric["bunches"] / metric["total"] * 100
-
+def draw_overview_chart(metric, tpts, outname):
     sns.set_style("darkgrid")
-    plt.figure()
-    g = sns.barplot(data=metric, x="time_point_id", y="percent", order=tpts["time_point_id"][1:-1])
-    plt.xticks(rotation=45)
-    g.get_figure().savefig(outname)
+    order = tpts["time_point_id"][1:-1]
+    fig = plotting.figure("overview")
+    ax = fig.subplots()
+    metric = metric.set_index("time_point_id").reindex(order)
+    plotting.bars(ax, order, metric["percent"], low=metric["low"], high=metric["high"],
+                  sparse=metric["sparse"].fillna(False).astype(bool))
+    ax.tick_params(axis="x", rotation=45)
+    ax.set_xlabel("time_point_id")
+    ax.set_ylabel("percent")
+    save_chart(fig, outname)
 
 def draw_tpt_legend(timepoints, outname):
     contents = timepoints[["time_point_id", "name"]]
-    plt.figure()
-    plt.axis('off')
-    tbl = plt.table(cellText=[r for _, r in contents.iterrows()],
+    fig = plotting.figure("legend")
+    ax = fig.subplots()
+    ax.axis('off')
+    tbl = ax.table(cellText=[r for _, r in contents.iterrows()],
                    colLabels=["id", "Station Name"],
                    colWidths=[.15,.85],
                    loc="center",
@@ -173,119 +702,307 @@ def draw_tpt_legend(timepoints, outname):
                    # fontsize=10,
                    # in_layout???
                    )
-    plt.savefig(outname)
+    save_chart(fig, outname)
     #tbl.auto_set_font_size(False)
     #tbl.set_fontsize(10)
 
-def draw_calendar(data, tpts, outname):
-    bunches_by_day = data.loc[data.bunched].groupby(["service_date", "time_point_id"])["headway"].count()
-    events_by_day = data.groupby(["service_date", "time_point_id"])["headway"].count()
-
-    full = pd.concat([bunches_by_day, events_by_day], axis=1).reset_index()
-    full.columns = ["service_date", "time_point_id", "bunches", "total"]
-    full["percent"] = full["bunches"] / full["total"] * 100
-    full["service_date"] = pd.to_datetime(full["service_date"])
-    full["day"] = full["service_date"].dt.day_name()
-    full["week"] = full["service_date"].dt.isocalendar().week
-    full.loc[full["day"] == "Sunday", "week"] += 1
-    if 1 in full["week"]:
-        full.loc[full["week"] >= 50, "week"] -= 52
-
-
-    days = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
-
-    g = sns.FacetGrid(data=full, col="day", row="week", col_order=days, margin_titles=True)#, gridspec_kws={"wspace":0.1, "hspace": 0.1})
-    g.map(sns.barplot, "time_point_id", "percent", order=tpts["time_point_id"][1:-1])
-    g.set_xticklabels(rotation=45)
-    g.fig.savefig(outname)
-
-def weekdays(ds):
-    holidays = calendar().holidays().date
-    return (ds.dt.day_of_week < 5) & ~ds.isin(holidays)
-
-def draw_time_of_day_plots(data, tpts, outname):
-    OFFSET = datetime.datetime(1900,1,1,0,0,0)
-    first_stop, last_stop = tpts.time_point_id.iloc[[1, -2]]
-
-    # First, select only 1st and last stops, and group by trip_id
-    bytrip = data.loc[data["time_point_id"].isin([first_stop, last_stop])]
-    bytrip = bytrip.pivot(index=["service_date", "half_trip_id"],
-                          columns="time_point_id", values=["actual", "bunched"]) \
-                   .reset_index() \
-                   .rename(columns={first_stop: "first", last_stop: "last"})
-    # Calculate hour of departure from first stop
-    bytrip["departure_hour"] = (bytrip[("actual", "first")] - OFFSET) // np.timedelta64(1, 'h')
-    bytrip = bytrip.dropna().drop("actual", axis=1, level=0)
-
-    # label business days as weekday
-    bytrip["weekday"] = weekdays(pd.to_datetime(bytrip["service_date"]))
-    # flatten columns
-    bytrip.columns = [x[1] or x[0] for x in bytrip.columns]
-
-    molten = bytrip.melt(id_vars=["departure_hour", "weekday"],
-                         value_vars=["first", "last"],
-                         var_name="stop", value_name="bunched")
-    grouped = molten.groupby(["weekday", "departure_hour", "stop"])["bunched"]
-    totals = grouped.count()
-    bunches = grouped.sum()
-    percents = (bunches / totals * 100).reset_index().rename(columns={"bunched": "Percent"})
-    percents["Trip Departure Hour"] = percents["departure_hour"].astype(int)
-    percents["Stop ID"] = percents["stop"].replace({"first": first_stop, "last": last_stop})
-
-    g = sns.catplot(data=percents, kind="bar", col="weekday", col_order=[True, False],
-                    x="Trip Departure Hour", y="Percent", hue="Stop ID")
-    g.fig.savefig(outname)
-
-"""
-# %% [markdown]
-# <h1>STRINGLINES!</h1>
-
-# %%
-DATE = "2022-03-04"
-
-strings = bothdirs.loc[(bothdirs.service_date == DATE) & (bothdirs.time_point_id.isin(timepoints.time_point_id))].copy()
-# strings["schedule_delay"] = (strings["actual"] - strings["scheduled"]).dt.total_seconds()
-strings["headway_delta"] = (strings["scheduled_headway"] - strings["headway"])
-strings
-
-# %%
-# mean_sched_delays = strings.groupby("half_trip_id")["schedule_delay"].mean()
-# strings["mean_schedule_adh"] = strings["half_trip_id"].map(mean_sched_delays)
-mean_headway_delays = strings.groupby("half_trip_id")["headway_delta"].mean()
-strings["mean_headway_delta"] = strings["half_trip_id"].map(mean_headway_delays)
-strings
-
-# %%
-sns.boxplot(mean_headway_delays)
-
-# %%
-sns.set(rc={'axes.facecolor':'white'})
-fig, ax = plt.subplots(figsize=(30,12))
-xfmt = mdates.DateFormatter('%H:%M')
-fig.axes[0].xaxis.set_major_formatter(xfmt)
-g = sns.lineplot(data=strings,#.loc[strings.direction_id == DIRECTION],
-                y='time_point_id',
-                x='actual',
-                hue='mean_headway_delta',
-                hue_norm=(-600,600),
-                palette=sns.color_palette("vlag", as_cmap=True),
-                units='half_trip_id',
-                estimator=None)
-g.set_title(f"{DATE} Route {ROUTE}")
-
-# %%
-g = sns.barplot(data=t, x="cat", hue='variable', y='value', order=HeadwayCategories)
-g.set_title("Route 1, inbound, March 2022")
-
-"""
+CALENDAR_DAYS = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+
+def calendar_cells(dates):
+    """Row (week) and column (day, Sunday first) of each date in a Sunday-to-Saturday calendar.
+
+    Rows count whole weeks from the Sunday on or before the first date, so
+    Sundays start a row and weeks never wrap at a year boundary. Each row is
+    labelled with the ISO week of its Monday.
+    """
+    day = ((dates.dt.dayofweek + 1) % 7).to_numpy()
+    sundays = dates - pd.to_timedelta(day, unit="D")
+    first = sundays.min()
+    week = ((sundays - first).dt.days // 7).to_numpy()
+    mondays = first + pd.to_timedelta(np.arange(week.max() + 1) * 7 + 1, unit="D")
+    return week, day, mondays.isocalendar().week.to_numpy()
+
+def draw_calendar(by_day, tpts, outname):
+    """Small multiples of each day's bunching by timepoint, laid out as a calendar.
+
+    The days are pivoted into one (week, day, timepoint) array and every bar
+    is drawn in a single ax.bar call, each day offset into its own cell of one
+    shared axes, rather than one seaborn barplot (and CI bootstrap) per day.
+    """
+    order = tpts["time_point_id"][1:-1].reset_index(drop=True)
+    week, day, labels = calendar_cells(pd.to_datetime(by_day["service_date"].astype(str)))
+    tpt = pd.Index(order).get_indexer(by_day["time_point_id"])
+    keep = tpt >= 0
+    cells = (week[keep], day[keep], tpt[keep])
+    grid, low, high = np.full((3, len(labels), 7, len(order)), np.nan)
+    grid[cells] = by_day["percent"].to_numpy()[keep]
+    low[cells] = by_day["low"].to_numpy()[keep]
+    high[cells] = by_day["high"].to_numpy()[keep]
+    sparse = np.zeros(grid.shape, dtype=bool)
+    sparse[cells] = by_day["sparse"].to_numpy()[keep]
+
+    nweeks, n = len(labels), len(order)
+    # scale to the intervals too, except sparse cells', whose wide bounds would flatten every bar
+    shown = np.concatenate([grid.ravel(), high[~sparse]])
+    top = np.nanmax(shown) if np.isfinite(shown).any() else 1
+    ticks = matplotlib.ticker.MaxNLocator(6).tick_values(0, top)
+    ymax = max(ticks[-1], top) * 1.03
+    ticks = ticks[ticks <= ymax]
+    # each day's cell spans n bars, with a one-bar gap to the next day and a 25% gap between weeks
+    width, height = n + 1, ymax * 1.25
+    x0 = np.arange(7) * width
+    y0 = (nweeks - 1 - np.arange(nweeks)) * height
+
+    fig = plotting.figure("calendar", (21, 3 * nweeks))
+    ax = fig.subplots()
+    # a single axes lays out quickly, so skip tight_layout
+    fig.set_layout_engine("none")
+    fig.subplots_adjust(left=0.04, right=0.97, bottom=0.4 / nweeks, top=1 - 0.12 / nweeks)
+    cell_color = ax.get_facecolor()
+    ax.set_facecolor("white")
+    ax.grid(False)
+
+    cells = [matplotlib.patches.Rectangle((x - 0.5, y), n, ymax) for y in y0 for x in x0]
+    ax.add_collection(matplotlib.collections.PatchCollection(cells, facecolor=cell_color, edgecolor="none"))
+    gridlines = [[(x - 0.5, y + t), (x + n - 0.5, y + t)] for y in y0 for x in x0 for t in ticks]
+    ax.add_collection(LineCollection(gridlines, colors="white", linewidths=1))
+
+    rows, cols, bars = np.nonzero(~np.isnan(grid))
+    heights = grid[rows, cols, bars]
+    # clip intervals to the cell, as separate facet axes would, so they don't run into the week above,
+    # and mark the ones that were cut off
+    clipped = high[rows, cols, bars] > ymax
+    ax.scatter(x0[cols][clipped] + bars[clipped], y0[rows][clipped] + ymax, marker="^", s=18,
+               color=plotting.ERROR_KW["ecolor"], zorder=3, clip_on=False)
+    high = np.minimum(high, ymax)
+    drawn = ax.bar(x0[cols] + bars, heights, bottom=y0[rows], width=0.8, color=plotting.palette(1)[0], zorder=2,
+                   yerr=plotting.error_bars(heights, low[rows, cols, bars], high[rows, cols, bars]),
+                   error_kw=plotting.ERROR_KW)
+    plotting.flag_sparse(drawn.patches, sparse[rows, cols, bars])
+
+    ax.set_xticks((x0[:, None] + np.arange(n)).ravel(), list(order) * 7, rotation=45)
+    ax.set_yticks((y0[:, None] + ticks).ravel(), [f"{t:g}" for t in ticks] * nweeks)
+    ax.tick_params(length=0)
+    for x, name in zip(x0, CALENDAR_DAYS):
+        ax.text(x + (n - 1) / 2, y0[0] + ymax * 1.02, f"day = {name}", ha="center", va="bottom")
+    for y, label in zip(y0, labels):
+        ax.text(x0[-1] + n - 0.3, y + ymax / 2, f"week = {label}", rotation=270, ha="left", va="center")
+    ax.set_xlim(-0.7, x0[-1] + n - 0.3)
+    ax.set_ylim(0, y0[0] + ymax)
+    ax.set_xlabel("time_point_id")
+    ax.set_ylabel("percent")
+    save_chart(fig, outname)
+
+def draw_time_of_day_plots(percents, tpts, outname):
+    hours = np.sort(percents["Trip Departure Hour"].unique())
+    stops = ["first", "last"]
+    stop_ids = percents.groupby("stop")["Stop ID"].first().reindex(stops)
+    fig = plotting.figure("tod", (11, 5))
+    axes = fig.subplots(1, 2, sharey=True)
+    for ax, weekday in zip(axes, [True, False]):
+        table = percents.loc[percents["weekday"] == weekday] \
+                        .pivot(index="Trip Departure Hour", columns="stop") \
+                        .reindex(index=hours)
+        table = {col: table[col].reindex(columns=stops).to_numpy() for col in ["Percent", "low", "high", "sparse"]}
+        plotting.grouped_bars(ax, hours, table["Percent"], stop_ids.tolist(), low=table["low"], high=table["high"],
+                              sparse=table["sparse"] == True)
+        ax.set_title(f"weekday = {weekday}")
+        ax.set_xlabel("Trip Departure Hour")
+    axes[0].set_ylabel("Percent")
+    axes[1].legend(title="Stop ID", loc="center left", bbox_to_anchor=(1, .5), frameon=False)
+    save_chart(fig, outname)
+
+def draw_headway_distribution(headways, tpts, outname):
+    """Stacked shares of each headway category, by timepoint and by hour."""
+    categories = headways["category"].cat.categories
+    colors = sns.color_palette("RdYlBu", len(categories))
+    fig = plotting.figure("headways", (10, 9))
+    axes = fig.subplots(2, 1)
+    for ax, key, order in [(axes[0], "time_point_id", tpts["time_point_id"][1:-1]), (axes[1], "hour", None)]:
+        shares = headways.pivot_table(index=key, columns="category", values="count",
+                                      aggfunc="sum", fill_value=0, observed=False)
+        if order is not None:
+            shares = shares.reindex(order, fill_value=0)
+        shares = shares.div(shares.sum(axis=1).replace(0, np.nan), axis=0) * 100
+        shares.plot(kind="bar", stacked=True, color=colors, width=0.85, ax=ax, legend=False)
+        ax.set_ylabel("Percent of headways")
+        ax.set_ylim(0, 100)
+    axes[0].set_xlabel("Timepoint")
+    axes[0].tick_params(axis="x", rotation=45)
+    axes[1].set_xlabel("Hour")
+    axes[1].tick_params(axis="x", rotation=0)
+    axes[0].legend(categories, title="Headway", loc="upper left", bbox_to_anchor=(1, 1))
+    save_chart(fig, outname)
+
+def draw_system_ranking(ranking, outname):
+    labels = ranking["route_id"] + " " + ranking["direction_id"].str[:3]
+    fig = plotting.figure("system", (11, 4))
+    ax = fig.subplots()
+    plotting.bars(ax, labels, ranking["percent"].to_numpy(), plotting.palette(1) * len(ranking))
+    ax.tick_params(axis="x", rotation=90)
+    ax.set_ylabel("percent")
+    save_chart(fig, outname)
+
+def draw_episodes(found, tpts, outname):
+    order = tpts["time_point_id"]
+    ends = np.column_stack([found["start_time_point"].value_counts().reindex(order, fill_value=0),
+                            found["end_time_point"].value_counts().reindex(order, fill_value=0)])
+    lengths = found["timepoints"].value_counts().reindex(np.arange(1, len(order) + 1), fill_value=0)
+
+    fig = plotting.figure("episodes", (11, 4.5))
+    axes = fig.subplots(1, 2, gridspec_kw={"width_ratios": [3, 2]})
+    plotting.grouped_bars(axes[0], order, ends, ["starts", "ends"])
+    axes[0].tick_params(axis="x", rotation=45)
+    axes[0].set_xlabel("time_point_id")
+    axes[0].set_ylabel("Episodes")
+    axes[0].legend(ncol=2, loc="lower center", bbox_to_anchor=(.5, 1), frameon=False)
+    plotting.bars(axes[1], lengths.index, lengths.to_numpy(), plotting.palette(1) * len(lengths))
+    axes[1].set_xlabel("Timepoints bunched in a row")
+    axes[1].set_ylabel("Episodes")
+    save_chart(fig, outname)
+
+def stringline_segments(day, tpts):
+    """One (x, y) line segment per consecutive pair of timepoints on each trip, plus a color value.
+
+    x is the actual time as a matplotlib date, y the timepoint's position in
+    `tpts`, and the value is the trip's mean headway delta (scheduled - actual
+    headway, in seconds) as in the notebook.
+    """
+    position = pd.Series(np.arange(len(tpts)), index=tpts["time_point_id"])
+    y = day["time_point_id"].map(position).to_numpy(dtype=float)
+    keep = ~np.isnan(y) & day["actual"].notna().to_numpy()
+    day = day.loc[keep]
+    y = y[keep]
+    x = mdates.date2num(day["actual"].to_numpy())
+    trips = pd.factorize(day["half_trip_id"])[0]
+
+    delta = (day["scheduled_headway"] - day["headway"]).to_numpy(dtype=float)
+    seen = ~np.isnan(delta)
+    sums = np.bincount(trips, weights=np.where(seen, delta, 0))
+    counts = np.bincount(trips, weights=seen)
+    trip_delta = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+
+    order = np.lexsort((day["time_point_order"].to_numpy(), trips))
+    x, y, trips = x[order], y[order], trips[order]
+    same = trips[1:] == trips[:-1]
+    points = np.column_stack([x, y])
+    segments = np.stack([points[:-1][same], points[1:][same]], axis=1)
+    return segments, trip_delta[trips[:-1][same]]
+
+def draw_stringline(day, tpts, outname):
+    segments, values = stringline_segments(day, tpts)
+    fig = plotting.figure("stringline", (11, 6))
+    ax = fig.subplots()
+    ax.set_facecolor("white")
+    lines = LineCollection(segments, cmap=sns.color_palette("vlag", as_cmap=True),
+                           norm=matplotlib.colors.Normalize(-600, 600), linewidths=1)
+    lines.set_array(values)
+    ax.add_collection(lines)
+    ax.autoscale()
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
+    ax.set_yticks(np.arange(len(tpts)), tpts["time_point_id"])
+    ax.set_xlabel("Time")
+    fig.colorbar(lines, ax=ax, label="Trip's mean headway delta (scheduled - actual, s)")
+    save_chart(fig, outname)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("month", choices=DATAFILES.keys())
-    parser.add_argument("route")
-    
-    args = parser.parse_args()
+    parser.add_argument("month", type=parse_month, help="YYYY-MM")
+    parser.add_argument("routes", nargs="*")
+    parser.add_argument("--all-routes", action="store_true",
+                        help="render a report for every route in the month")
+    parser.add_argument("--to", metavar="YYYY-MM", type=parse_month,
+                        help="report on every month from `month` through this one")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="render routes in parallel with this many processes")
+    parser.add_argument("--update", action="store_true",
+                        help="merge new service dates from the month's csv into the aggregate store, then exit")
+    parser.add_argument("--from-store", action="store_true",
+                        help="render from the aggregate store rather than the month's raw data")
+    parser.add_argument("--dump-images", action="store_true",
+                        help="also write each chart to imgs/{route}_{direction}/ for debugging")
+    parser.add_argument("--chart-format", choices=["png", "jpg", "svg"], default="png",
+                        help="embed charts as png/jpg rasters or as svg vector graphics")
+    parser.add_argument("--dpi", type=int, help="resolution for raster charts")
+    parser.add_argument("--jpeg-quality", type=int, default=85)
+    parser.add_argument("--stringlines", type=int, default=1, metavar="N",
+                        help="add stringline pages for the N days with the most bunching (0 for none)")
+    parser.add_argument("--stringline-date", action="append", default=[], metavar="YYYY-MM-DD",
+                        help="also add a stringline page for this service date; may be repeated")
+    parser.add_argument("--bunch-threshold", type=aggregate.BunchThreshold.parse, metavar="SECONDS|FRACTION",
+                        help="headways under this are bunched: seconds (default 120), or a fraction "
+                             "of the scheduled headway such as 0.25H or 25%%")
+    parser.add_argument("--system", action="store_true",
+                        help="rank every route in the month by bunching into system_YYYY-MM.csv/.pdf, then exit")
+    parser.add_argument("--episodes", action="store_true",
+                        help="write every bunching episode in the month (for `routes`, or all) "
+                             "to episodes_YYYY-MM.csv, then exit")
+    parser.add_argument("--force", action="store_true",
+                        help="render every report even if an identical one is in the render cache")
+    parser.add_argument("--render-cache-mb", type=int, default=report_cache.MAX_BYTES >> 20,
+                        help="evict the least recently used cached reports beyond this size")
+    parser.add_argument("--min-sample", type=int, default=aggregate.MIN_SAMPLE,
+                        help="flag bunching percents based on fewer headways than this")
+    parser.add_argument("--ingest", action="store_true",
+                        help="convert the month's csv into the parquet cache, then exit")
+    parser.add_argument("--stream", choices=["pandas", "pyarrow"],
+                        help="without a cache, stream the csv in chunks with this engine, "
+                             "keeping only the requested routes' rows")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="append per-stage timing/memory records to this JSON lines file")
+    parser.add_argument("--profile", choices=["cprofile", "tracemalloc"],
+                        help="run under a profiler and print its top entries")
+    parser.add_argument("--profile-out", metavar="PATH", help="also save the raw profile here")
 
-    generate_report(args.route, args.month, f"{args.route}_{args.month}22.pdf")
-    
\ No newline at end of file
+    args = parser.parse_args()
+    OPTIONS = RenderOptions(args.dump_images, args.chart_format, args.dpi, args.jpeg_quality,
+                            args.stringlines, tuple(args.stringline_date))
+    instrument.JSONL_PATH = args.metrics
+    aggregate.THRESHOLD = args.bunch_threshold or aggregate.THRESHOLD
+    aggregate.MIN_SAMPLE = args.min_sample
+    report_cache.FORCE = args.force
+    report_cache.MAX_BYTES = args.render_cache_mb << 20
+    if args.month not in DATAFILES and not ingest.is_cached(args.month, None):
+        parser.error(f"no data for {args.month}; available: {', '.join(available_months()) or 'none'}")
+    if (args.ingest or args.update) and args.month not in DATAFILES:
+        parser.error(f"{'--ingest' if args.ingest else '--update'} needs {args.month}'s csv, "
+                     "but only its cache is here")
+    if args.to is not None and args.to < args.month:
+        parser.error(f"--to {args.to} is before {args.month}")
+    if args.to is not None and not range_months(args.month, args.to):
+        parser.error(f"no data for any month from {args.month} to {args.to}")
+
+    failed = []
+    with instrument.profiling(args.profile, args.profile_out):
+        if args.ingest:
+            print("ingesting", args.month, "->", ingest.build_cache(args.month, DATAFILES[args.month]))
+        elif args.system:
+            generate_system_summary(args.month)
+        elif args.episodes:
+            write_episodes(args.month, args.routes)
+        elif args.update:
+            print("merged service dates:", store.update(DATAFILES[args.month]))
+        elif args.from_store:
+            for route in args.routes:
+                generate_store_report(route, args.month, report_name(route, args.month))
+        elif args.to is not None:
+            for route in args.routes:
+                generate_range_report(route, args.month, args.to,
+                                      f"{route}_{args.month}_{args.to}.pdf")
+        elif args.workers is not None and (args.all_routes or args.routes):
+            failed = [job.route for job in generate_reports_parallel(args.month, args.routes or None, args.workers)
+                      if not job.ok]
+        elif args.all_routes or len(args.routes) > 1:
+            generate_all_reports(args.month, args.routes or None, args.stream or "pandas")
+        elif args.routes:
+            route = args.routes[0]
+            data = load_data(args.month, route, args.stream) if args.stream else None
+            generate_report(route, args.month, report_name(route, args.month), data)
+        else:
+            parser.error("a route is required unless --ingest or --all-routes is given")
+
+    if instrument.RECORDS:
+        print(instrument.summary().to_string(float_format="{:.2f}".format))
+    if failed:
+        parser.exit(1, f"failed: {', '.join(failed)}\n")
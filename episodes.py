@@ -0,0 +1,71 @@
+import numpy as np
+
+# Vehicles are compared to the one ahead of them at the same timepoint on the same day
+GROUP_KEYS = ["route_id", "service_date", "direction_id", "time_point_id"]
+
+
+def group_codes(data, keys):
+    # one integer per distinct key combination, ignoring keys the frame doesn't have
+    return data.groupby([k for k in keys if k in data], observed=True, sort=False).ngroup().to_numpy()
+
+def leader_rows(data):
+    """Row position of the vehicle ahead of each row at its timepoint, or -1 if it was first.
+
+    Rows are sorted by actual time within each (route, date, direction,
+    timepoint) group and linked to their predecessor with a shift, so this
+    is one sort over the whole frame. Rows without an actual time have no
+    leader and lead nothing.
+    """
+    group = group_codes(data, GROUP_KEYS)
+    actual = data["actual"].to_numpy().astype("datetime64[ns]")
+    seen = ~np.isnat(actual)
+    order = np.lexsort((actual.astype(np.int64), group))
+    order = order[seen[order]]
+    linked = group[order[1:]] == group[order[:-1]]
+    leaders = np.full(len(data), -1)
+    leaders[order[1:][linked]] = order[:-1][linked]
+    return leaders
+
+def find(data):
+    """Bunching episodes: runs of consecutive timepoints where the same pair of trips stayed bunched.
+
+    A follower trip is bunched with its leader at a timepoint when its row is
+    `bunched`. Each leader/follower pair's bunched rows are ordered along the
+    follower's trip, and an episode ends when the pair stops being bunched,
+    another vehicle comes between them, or the follower skips a timepoint.
+    Returns one row per episode with where and when it started and ended,
+    and how many timepoints it lasted.
+    """
+    leaders = leader_rows(data)
+    trips = group_codes(data, ["route_id", "service_date", "half_trip_id"])
+    tpo = data["time_point_order"].to_numpy()
+
+    # position of each row along its trip, so skipped timepoints break an episode
+    by_trip = np.lexsort((tpo, trips))
+    first = np.r_[True, trips[by_trip][1:] != trips[by_trip][:-1]]
+    starts_at = np.maximum.accumulate(np.where(first, np.arange(len(by_trip)), 0))
+    step = np.empty(len(data), dtype=np.int64)
+    step[by_trip] = np.arange(len(by_trip)) - starts_at
+
+    rows = np.flatnonzero(data["bunched"].to_numpy(dtype=bool) & (leaders >= 0))
+    # a trip that passes a timepoint twice (e.g. dudly, merged into nubn) can't bunch with itself
+    rows = rows[trips[leaders[rows]] != trips[rows]]
+    pair = trips[rows].astype(np.int64) * (trips.max() + 1 if len(trips) else 1) + trips[leaders[rows]]
+    order = np.lexsort((step[rows], pair))
+    rows, pair = rows[order], pair[order]
+    new = np.r_[True, (pair[1:] != pair[:-1]) | (np.diff(step[rows]) != 1)]
+    begins = np.flatnonzero(new[:len(rows)])
+    ends = np.r_[begins[1:], len(rows)] - 1
+    first_row, last_row = rows[begins], rows[ends]
+
+    columns = [c for c in ["route_id", "service_date", "direction_id"] if c in data]
+    episodes = data.iloc[first_row][columns].reset_index(drop=True)
+    episodes["leader"] = data["half_trip_id"].to_numpy()[leaders[first_row]]
+    episodes["follower"] = data["half_trip_id"].to_numpy()[first_row]
+    for end, at in [("start", first_row), ("end", last_row)]:
+        episodes[f"{end}_time_point"] = data["time_point_id"].to_numpy()[at]
+        episodes[f"{end}_order"] = tpo[at]
+        episodes[end] = data["actual"].to_numpy()[at]
+    episodes["timepoints"] = ends - begins + 1
+    episodes["seconds"] = (episodes["end"] - episodes["start"]).dt.total_seconds()
+    return episodes
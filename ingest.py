@@ -0,0 +1,197 @@
+import os
+import pathlib
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
+CACHE_DIR = pathlib.Path("./cache")
+# Written into each month's cache with the source_signature of the csv it was built from;
+# parquet readers skip files starting with "_"
+SOURCE_STAMP = "_source"
+
+# Columns kept in the cache, and the subset the report charts actually read
+COLUMNS = ["service_date", "route_id", "direction_id", "half_trip_id", "time_point_id",
+           "time_point_order", "scheduled", "actual", "scheduled_headway", "headway"]
+REPORT_COLUMNS = ["service_date", "direction_id", "half_trip_id", "time_point_id",
+                  "time_point_order", "actual", "scheduled_headway", "headway"]
+CATEGORICAL = ["route_id", "direction_id", "time_point_id"]
+
+# Compact dtypes for the csv columns. Headways can be missing, so they are floats;
+# float32 holds whole seconds exactly.
+DTYPES = {
+    "service_date": "category",
+    "route_id": "category",
+    "direction_id": "category",
+    "time_point_id": "category",
+    "time_point_order": np.int32,
+    "headway": np.float32,
+    "scheduled_headway": np.float32,
+}
+# What the pyarrow reader parses the numeric columns as, before the DTYPES cast
+ARROW_TYPES = {
+    "time_point_order": pa.int32(),
+    "headway": pa.float64(),
+    "scheduled_headway": pa.float64(),
+}
+DATETIME_COLUMNS = ["scheduled", "actual"]
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+STREAM_CHUNKSIZE = 1_000_000  # rows per chunk for the pandas reader
+STREAM_BLOCK_SIZE = 64 << 20  # bytes per block for the pyarrow reader
+
+
+def read_csv(filename, columns=COLUMNS, chunksize=None):
+    """pd.read_csv with compact dtypes and only `columns`; datetimes are left as strings."""
+    return pd.read_csv(filename, usecols=columns, chunksize=chunksize,
+                       dtype={col: dtype for col, dtype in DTYPES.items() if col in columns})
+
+
+def normalize_timepoints(monthly):
+    # lower-case and merge dudly into nubn on the categories, not on every row
+    tpts = monthly["time_point_id"].astype("category")
+    categories = tpts.cat.categories
+    names = pd.Series(categories.str.lower(), index=categories).replace("dudly", "nubn")
+    monthly["time_point_id"] = tpts.map(names).astype("category")
+    return monthly
+
+
+def parse_datetimes(monthly):
+    for col in DATETIME_COLUMNS:
+        if col in monthly and not pd.api.types.is_datetime64_dtype(monthly[col]):
+            try:
+                monthly[col] = pd.to_datetime(monthly[col], format=DATETIME_FORMAT)
+            except ValueError:
+                # some months are published in another format; fall back to inference
+                monthly[col] = pd.to_datetime(monthly[col])
+    return monthly
+
+
+def prepare(monthly):
+    """Normalize timepoint ids and parse datetimes on freshly read rows."""
+    return parse_datetimes(normalize_timepoints(monthly))
+
+
+def cache_path(month):
+    return CACHE_DIR / month
+
+
+def route_partition(month, route):
+    return cache_path(month) / f"route_id={route}"
+
+
+def is_cached(month, filename):
+    """Whether the month's cache exists and was built from `filename` as it is now.
+
+    A month whose csv isn't around (only the cache was shipped) is taken as is.
+    """
+    if not cache_path(month).exists():
+        return False
+    if not filename or not pathlib.Path(filename).exists():
+        return True
+    stamp = cache_path(month) / SOURCE_STAMP
+    return stamp.exists() and stamp.read_text() == source_signature(filename, month)
+
+
+def source_signature(filename, month):
+    """Identify the data behind a month by size and mtime, for invalidating derived files."""
+    path = pathlib.Path(filename) if filename else None
+    if path is None or not path.exists():
+        # only the parquet cache was shipped; it is rebuilt wholesale, so its mtime will do
+        path = cache_path(month)
+    stat = path.stat()
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def build_cache(month, filename):
+    """Convert one monthly CSV into parquet, partitioned by route and direction."""
+    signature = source_signature(filename, month)
+    monthly = prepare(read_csv(filename))
+
+    outdir = cache_path(month)
+    # build beside the cache and swap it in, so an interrupted ingest never looks complete
+    tmp = CACHE_DIR / f".{month}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.parent.mkdir(parents=True, exist_ok=True)
+    monthly.to_parquet(tmp, partition_cols=["route_id", "direction_id"], index=False)
+    (tmp / SOURCE_STAMP).write_text(signature)
+    shutil.rmtree(outdir, ignore_errors=True)
+    os.replace(tmp, outdir)
+    return outdir
+
+
+def cached_routes(month):
+    return sorted(p.name.split("=", 1)[1] for p in cache_path(month).glob("route_id=*"))
+
+
+def pandas_chunks(filename, columns, routes):
+    for chunk in read_csv(filename, columns, STREAM_CHUNKSIZE):
+        if routes is not None:
+            chunk = chunk.take(np.flatnonzero(chunk["route_id"].isin(routes)))
+        yield chunk
+
+
+def arrow_chunks(filename, columns, routes):
+    # keep ids and datetimes as strings so nothing is converted before the filter; numbers are
+    # pinned too, as a type inferred from the first block (all-empty headways, whole numbers) can
+    # reject later ones
+    column_types = {col: pa.string() for col in columns if col in DTYPES and DTYPES[col] == "category"}
+    column_types.update({col: pa.string() for col in DATETIME_COLUMNS if col in columns})
+    column_types.update({col: ARROW_TYPES[col] for col in columns if col in ARROW_TYPES})
+    reader = pacsv.open_csv(filename,
+                            read_options=pacsv.ReadOptions(block_size=STREAM_BLOCK_SIZE),
+                            convert_options=pacsv.ConvertOptions(include_columns=columns,
+                                                                 column_types=column_types))
+    wanted = None if routes is None else pa.array(list(routes), pa.string())
+    for batch in reader:
+        if wanted is not None:
+            batch = batch.filter(pc.is_in(batch.column("route_id"), value_set=wanted))
+        yield batch.to_pandas().astype({col: DTYPES[col] for col in columns if col in DTYPES})
+
+
+def stream_routes(filename, routes=None, columns=REPORT_COLUMNS + ["route_id"], engine="pandas"):
+    """Yield only `routes`' rows from a monthly csv, one prepared chunk at a time.
+
+    Rows are filtered on route_id straight after reading, so date parsing and
+    timepoint normalization only run on the rows that are kept, and memory is
+    bounded by the chunk size rather than the file size.
+    """
+    chunks = arrow_chunks if engine == "pyarrow" else pandas_chunks
+    for chunk in chunks(filename, columns, routes):
+        if len(chunk):
+            yield prepare(chunk)
+
+
+def split_routes(filename, routes=None, engine="pandas"):
+    """Stream a monthly CSV in chunks, splitting it into one frame per route.
+
+    Only the report columns are kept, and each route's chunks are concatenated
+    only as its (route, frame) pair is yielded, so peak memory is the per-route
+    buffers plus one route's frame rather than the full parsed file plus every copy.
+    """
+    buffers = {}
+    for chunk in stream_routes(filename, routes, engine=engine):
+        for route, group in chunk.groupby("route_id", sort=False, observed=True):
+            buffers.setdefault(route, []).append(group.drop(columns="route_id"))
+    while buffers:
+        # pop first, so a route's chunks are freed as its frame is built
+        route, parts = buffers.popitem()
+        yield route, concat_chunks(parts)
+
+
+def concat_chunks(parts):
+    # categories differ from chunk to chunk, so concat falls back to object; restore them
+    frame = pd.concat(parts, ignore_index=True)
+    for col in ["service_date", "direction_id", "time_point_id"]:
+        frame[col] = frame[col].astype("category")
+    return frame
+
+
+def read_route(month, route, columns=REPORT_COLUMNS):
+    """Read a single route's partition from the cache, pruned to `columns`."""
+    data = pd.read_parquet(route_partition(month, route), columns=columns)
+    data["time_point_id"] = data["time_point_id"].cat.remove_unused_categories()
+    return data
@@ -0,0 +1,91 @@
+import contextlib
+import cProfile
+import json
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+# Every finished stage, plus labels (route, direction, ...) applied to the stages inside them
+RECORDS = []
+LABELS = {}
+# Set by --metrics to also append each record to a JSON lines file as it finishes
+JSONL_PATH = None
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+@contextlib.contextmanager
+def labels(**kwargs):
+    """Tag every stage recorded inside this block, e.g. with route=... and direction=..."""
+    previous = dict(LABELS)
+    LABELS.update(kwargs)
+    try:
+        yield
+    finally:
+        LABELS.clear()
+        LABELS.update(previous)
+
+@contextlib.contextmanager
+def stage(name, rows=None):
+    """Record wall time, peak RSS and row count for the enclosed block.
+
+    Yields the record, so `rows` can be filled in once it is known.
+    """
+    record = {"stage": name, **LABELS, "rows": rows}
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        record["peak_rss_mb"] = peak_rss_mb()
+        if tracemalloc.is_tracing():
+            record["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        RECORDS.append(record)
+        if JSONL_PATH is not None:
+            with open(JSONL_PATH, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+
+def summary():
+    """Total time, peak memory and rows per stage over everything recorded so far."""
+    if not RECORDS:
+        return pd.DataFrame()
+    records = pd.DataFrame(RECORDS)
+    return records.groupby("stage", sort=False).agg(
+        calls=("seconds", "size"), seconds=("seconds", "sum"), max_seconds=("seconds", "max"),
+        rows=("rows", "sum"), peak_rss_mb=("peak_rss_mb", "max"))
+
+@contextlib.contextmanager
+def profiling(mode=None, outname=None):
+    """Run the enclosed block under cProfile or tracemalloc, printing the top entries after."""
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if outname:
+                profiler.dump_stats(outname)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    elif mode == "tracemalloc":
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            if outname:
+                snapshot.dump(outname)
+            for line in snapshot.statistics("lineno")[:25]:
+                print(line)
+    else:
+        yield
@@ -0,0 +1,73 @@
+"""Bar charts from pre-aggregated values, drawn straight to matplotlib.
+
+The report tables already hold one value per bar, so nothing here runs an
+estimator or bootstraps a confidence interval; error bars come from the
+intervals computed alongside the percents, and seaborn only supplies the
+style and palette.
+"""
+import matplotlib.figure
+import numpy as np
+import seaborn as sns
+
+# One Figure per chart kind, cleared and redrawn for every route and direction.
+# They are never registered with pyplot, so nothing accumulates in long batch runs.
+FIGURES = {}
+ERROR_KW = {"ecolor": ".26", "elinewidth": 1, "capsize": 0}
+SPARSE_ALPHA = .35
+
+
+def figure(name, figsize=None):
+    """The reusable Figure for chart `name`, cleared and sized to `figsize` (rc default if unset)."""
+    fig = FIGURES.get(name)
+    if fig is None:
+        fig = FIGURES[name] = matplotlib.figure.Figure(figsize=figsize)
+    else:
+        fig.clear()
+        fig.set_size_inches(figsize or matplotlib.rcParams["figure.figsize"])
+    return fig
+
+def palette(n):
+    # seaborn's bar colors: the current palette, desaturated as barplot does
+    return [sns.desaturate(color, .75) for color in sns.color_palette(n_colors=n)]
+
+def categorical_axis(ax, labels):
+    x = np.arange(len(labels))
+    ax.set_xticks(x, labels)
+    ax.set_xlim(-0.5, len(labels) - 0.5)
+    ax.xaxis.grid(False)
+    return x
+
+def error_bars(values, low, high):
+    # matplotlib wants distances below and above each bar, not the bounds
+    values = np.asarray(values, dtype=float)
+    return np.vstack([values - np.asarray(low, dtype=float), np.asarray(high, dtype=float) - values])
+
+def flag_sparse(patches, sparse):
+    # fade and outline bars resting on too few samples; no hatching, as fpdf2 can't read svg hatch patterns
+    for patch, flag in zip(patches, sparse):
+        if flag:
+            patch.set_alpha(SPARSE_ALPHA)
+            patch.set(edgecolor=ERROR_KW["ecolor"], linestyle="--", linewidth=1)
+
+def bars(ax, labels, values, colors=None, width=0.8, low=None, high=None, sparse=None):
+    """One bar per label, in the order given; missing values leave a gap.
+
+    `low`/`high` add error bars, and bars where `sparse` is true are faded.
+    """
+    x = categorical_axis(ax, labels)
+    yerr = None if low is None else error_bars(values, low, high)
+    drawn = ax.bar(x, values, width=width, color=colors or palette(len(labels)), yerr=yerr, error_kw=ERROR_KW)
+    if sparse is not None:
+        flag_sparse(drawn.patches, sparse)
+
+def grouped_bars(ax, labels, values, hues, colors=None, width=0.8, low=None, high=None, sparse=None):
+    """A group of side-by-side bars per label, one per hue; `values` (and `low`, `high`, `sparse`) are labels x hues."""
+    x = categorical_axis(ax, labels)
+    colors = colors or palette(len(hues))
+    each = width / len(hues)
+    for i, hue in enumerate(hues):
+        yerr = None if low is None else error_bars(values[:, i], low[:, i], high[:, i])
+        drawn = ax.bar(x - width / 2 + each * (i + .5), values[:, i], width=each, color=colors[i], label=hue,
+                       yerr=yerr, error_kw=ERROR_KW)
+        if sparse is not None:
+            flag_sparse(drawn.patches, sparse[:, i])
@@ -0,0 +1,92 @@
+"""Content-addressed cache of rendered report pdfs.
+
+A report is keyed by a hash of everything that goes into it: the route's
+rows, the checkpoint names, the bunching threshold and minimum sample, the
+render options and the source of the modules that aggregate and draw it. An unchanged report
+is copied out of the cache instead of being rendered again.
+"""
+import dataclasses
+import functools
+import hashlib
+import os
+import pathlib
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import ingest
+
+# Set by --force to always render (the fresh pdf still replaces the cached one)
+FORCE = False
+# Set by --render-cache-mb; least recently used pdfs are evicted beyond this
+MAX_BYTES = 1 << 30
+CODE_FILES = ["draw_reports.py", "aggregate.py", "episodes.py", "plotting.py", "ingest.py"]
+
+
+def cache_dir():
+    return ingest.CACHE_DIR / "renders"
+
+def digest(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    here = pathlib.Path(__file__).parent
+    return digest(*[(here / name).read_bytes() for name in CODE_FILES])
+
+def frame_digest(data):
+    # hashes values regardless of column and row order, so the parquet cache and csv paths agree
+    columns = sorted(data.columns)
+    rows = pd.util.hash_pandas_object(data[columns], index=False).to_numpy()
+    return digest(",".join(columns), np.sort(rows).tobytes())
+
+def file_digest(path):
+    return digest(pathlib.Path(path).read_bytes())
+
+def report_key(data, checkpoint_file, threshold, min_sample, options):
+    # where charts are dumped doesn't change the pdf
+    options = dataclasses.replace(options, dump_images=False)
+    return digest(frame_digest(data), file_digest(checkpoint_file), threshold, min_sample, options,
+                  code_version())
+
+def path(key):
+    return cache_dir() / f"{key}.pdf"
+
+def fetch(key, outname):
+    """Copy the cached pdf for `key` to `outname`; False if there is none (or FORCE is set)."""
+    cached = path(key)
+    if FORCE or not cached.exists():
+        return False
+    shutil.copyfile(cached, outname)
+    # mtime records last use, for eviction
+    os.utime(cached)
+    return True
+
+def store(key, outname):
+    """Add a freshly rendered pdf to the cache, then evict down to MAX_BYTES."""
+    cached = path(key)
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    # copy-then-rename so a concurrent fetch never sees a partial file
+    tmp = cached.with_suffix(f".{os.getpid()}.tmp")
+    shutil.copyfile(outname, tmp)
+    os.replace(tmp, cached)
+    evict()
+
+def evict(max_bytes=None):
+    """Delete the least recently used pdfs until the cache fits in `max_bytes`. Returns the number deleted."""
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    files = sorted(cache_dir().glob("*.pdf"), key=lambda p: p.stat().st_mtime)
+    total = sum(p.stat().st_size for p in files)
+    deleted = 0
+    for p in files:
+        if total <= max_bytes:
+            break
+        total -= p.stat().st_size
+        p.unlink(missing_ok=True)
+        deleted += 1
+    return deleted
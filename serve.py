@@ -0,0 +1,197 @@
+"""Serve reports and single charts over HTTP, keeping hot data and renders in memory.
+
+    GET /months                                         months with data, as JSON
+    GET /routes/<month>                                 a month's routes, as JSON
+    GET /report/<month>/<route>.pdf                     the full report
+    GET /chart/<month>/<route>/<direction>/<name>.<png|svg>
+        name is overview, tod, cal, headways, episodes, legend or stringline_<YYYY-MM-DD>
+
+A month is ingested into the parquet cache on its first request, so later
+requests only read one route's partition.
+"""
+import argparse
+import collections
+import concurrent.futures
+import dataclasses
+import http.server
+import io
+import json
+import pathlib
+import re
+import tempfile
+import threading
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+
+import aggregate
+import draw_reports
+import ingest
+import instrument
+
+# matplotlib, the reused figures and draw_reports.OPTIONS are shared, so one render at a time
+RENDER_LOCK = threading.Lock()
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+class Memo:
+    """An LRU cache of up to `maxsize` results of `compute(*key)`.
+
+    Concurrent calls for a key that is still being computed wait for that
+    computation rather than starting their own. Failures are not cached.
+    """
+    def __init__(self, compute, maxsize):
+        self.compute = compute
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # key -> Future
+
+    def __call__(self, *key):
+        with self.lock:
+            future = self.entries.get(key)
+            owner = future is None
+            if owner:
+                future = self.entries[key] = concurrent.futures.Future()
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+            else:
+                self.entries.move_to_end(key)
+        if owner:
+            try:
+                future.set_result(self.compute(*key))
+            except Exception as e:
+                with self.lock:
+                    if self.entries.get(key) is future:
+                        del self.entries[key]
+                future.set_exception(e)
+        return future.result()
+
+
+def ingest_month(month):
+    if month not in draw_reports.DATAFILES and not ingest.is_cached(month, None):
+        raise KeyError(f"no data for {month}")
+    if not ingest.is_cached(month, draw_reports.DATAFILES.get(month)):
+        ingest.build_cache(month, draw_reports.DATAFILES[month])
+    return ingest.cached_routes(month)
+
+def load_route(month, route):
+    if route not in MONTHS(month):
+        raise KeyError(f"no route {route} in {month}")
+    return draw_reports.load_data(month, route)
+
+def direction_aggregates(month, route, direction):
+    if direction not in draw_reports.DIRECTIONS:
+        raise KeyError(f"no direction {direction}")
+    data = ROUTE_DATA(month, route)
+    onedir_data = draw_reports.direction_slice(data, direction).copy()
+    onedir_data["bunched"] = aggregate.is_bunched(onedir_data)
+    timepoints = draw_reports.get_timepoints(onedir_data, (month, route, direction))
+    return onedir_data, timepoints, aggregate.aggregate(onedir_data, timepoints)
+
+def render_chart(month, route, direction, name, fmt):
+    onedir_data, tpts, aggs = AGGREGATES(month, route, direction)
+    draw = {
+        "overview": lambda out: draw_reports.draw_overview_chart(aggs.by_timepoint, tpts, out),
+        "tod": lambda out: draw_reports.draw_time_of_day_plots(aggs.by_hour, tpts, out),
+        "cal": lambda out: draw_reports.draw_calendar(aggs.by_day, tpts, out),
+        "headways": lambda out: draw_reports.draw_headway_distribution(aggs.headways, tpts, out),
+        "episodes": lambda out: draw_reports.draw_episodes(aggs.episodes, tpts, out),
+        "legend": lambda out: draw_reports.draw_tpt_legend(tpts, out),
+    }
+    if name.startswith("stringline_"):
+        day = onedir_data.loc[onedir_data["service_date"] == name.split("_", 1)[1]]
+        if not len(day):
+            raise KeyError(f"no service on {name.split('_', 1)[1]}")
+        draw[name] = lambda out: draw_reports.draw_stringline(day, tpts, out)
+    if name not in draw:
+        raise KeyError(f"no chart {name}")
+    out = io.BytesIO()
+    with RENDER_LOCK:
+        options = draw_reports.OPTIONS
+        draw_reports.OPTIONS = dataclasses.replace(options, format=fmt)
+        try:
+            draw[name](out)
+        finally:
+            draw_reports.OPTIONS = options
+            instrument.RECORDS.clear()
+    return out.getvalue()
+
+def render_report(month, route):
+    data = ROUTE_DATA(month, route)
+    with RENDER_LOCK, tempfile.TemporaryDirectory() as tmp:
+        outname = pathlib.Path(tmp) / draw_reports.report_name(route, month)
+        try:
+            # the report cache can often answer this without drawing anything
+            draw_reports.generate_report(route, month, str(outname), data.copy())
+        finally:
+            instrument.RECORDS.clear()
+        return outname.read_bytes()
+
+MONTHS = Memo(ingest_month, maxsize=12)
+ROUTE_DATA = Memo(load_route, maxsize=32)
+AGGREGATES = Memo(direction_aggregates, maxsize=64)
+CHART_BYTES = Memo(render_chart, maxsize=512)
+REPORTS = Memo(render_report, maxsize=32)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    PATHS = [
+        (re.compile(r"/months"),
+         lambda: ("application/json", json.dumps(draw_reports.available_months()).encode())),
+        (re.compile(r"/routes/(\d{4}-\d{2})"), lambda month: ("application/json", json.dumps(MONTHS(month)).encode())),
+        (re.compile(r"/report/(\d{4}-\d{2})/([^/]+)\.pdf"),
+         lambda month, route: ("application/pdf", REPORTS(month, route))),
+        (re.compile(r"/chart/(\d{4}-\d{2})/([^/]+)/([^/]+)/([\w-]+)\.(png|svg)"),
+         lambda month, route, direction, name, fmt: (FORMATS[fmt], CHART_BYTES(month, route, direction, name, fmt))),
+    ]
+
+    def do_GET(self):
+        start = time.perf_counter()
+        path = self.path.split("?", 1)[0]
+        for pattern, handle in self.PATHS:
+            match = pattern.fullmatch(path)
+            if match:
+                break
+        else:
+            return self.send_error(404, "unknown path")
+        try:
+            content_type, body = handle(*match.groups())
+        except KeyError as e:
+            return self.send_error(404, str(e.args[0]))
+        except Exception as e:
+            return self.send_error(500, repr(e))
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Seconds", f"{time.perf_counter() - start:.3f}")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(host="127.0.0.1", port=8000):
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    print(f"serving on http://{host}:{server.server_address[1]}/")
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="serve bunching reports and charts over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--synthetic", action="store_true",
+                        help="serve a generated month (2022-03, routes 1-3) instead of ./in-data")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.synthetic:
+            import benchmark
+            import synthetic
+            print("synthetic month:", benchmark.use_synthetic_month(pathlib.Path(tmp), synthetic.generate(routes=3)))
+        server = serve(args.host, args.port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,88 @@
+import os
+import re
+
+import pandas as pd
+
+import aggregate
+import ingest
+
+STORE_DIR = ingest.CACHE_DIR / "aggregates"
+
+
+def route_dir(route):
+    return STORE_DIR / f"route_id={route}"
+
+
+def seen_dates(threshold):
+    # (route, date) pairs already stored, so a route whose file failed to write is merged next time
+    if not STORE_DIR.exists():
+        return pd.MultiIndex.from_arrays([[], []], names=["route_id", "service_date"])
+    rows = pd.read_parquet(STORE_DIR, columns=["route_id", "service_date", "threshold"])
+    rows = rows.loc[rows["threshold"] == threshold.label(), ["route_id", "service_date"]]
+    return pd.MultiIndex.from_frame(rows.astype(str).drop_duplicates())
+
+
+def read(route, month=None, threshold=None):
+    """Stored aggregate rows for `route`, optionally only those in `month` ("YYYY-MM").
+
+    Only rows counted against `threshold` (aggregate.THRESHOLD if unset) are
+    returned; if the route was only stored under other thresholds, that's a
+    ValueError rather than a report mislabeled with this one.
+    """
+    threshold = threshold or aggregate.THRESHOLD
+    rows = pd.read_parquet(route_dir(route))
+    rows = rows.drop(columns="route_id", errors="ignore")
+    if month is not None:
+        rows = rows.loc[rows["service_date"].str.startswith(month)]
+    counted = rows["threshold"] == threshold.label()
+    if len(rows) and not counted.any():
+        stored = ", ".join(f'"{label}"' for label in sorted(rows["threshold"].unique()))
+        raise ValueError(f"route {route} is stored with bunching {stored}, not \"{threshold.label()}\"; "
+                         "run --update with the same --bunch-threshold first")
+    return rows.loc[counted].drop(columns="threshold")
+
+
+def update(filename, chunksize=1_000_000, threshold=None):
+    """Merge the service dates in `filename` that the store hasn't seen yet.
+
+    Rows for dates already stored for their route are dropped as each chunk
+    is read, so only the new days are normalized and aggregated; the whole
+    csv is still parsed to find them. Each update adds one small
+    parquet file per route, counted against `threshold` (aggregate.THRESHOLD
+    if unset), which is kept as a column; dates stored under another threshold
+    count as new. Returns the newly merged dates.
+    """
+    threshold = threshold or aggregate.THRESHOLD
+    seen = seen_dates(threshold)
+    new = []
+    for chunk in ingest.read_csv(filename, ingest.REPORT_COLUMNS + ["route_id"], chunksize):
+        keys = pd.MultiIndex.from_arrays([chunk["route_id"].astype(str), chunk["service_date"].astype(str)])
+        chunk = chunk.loc[~keys.isin(seen)]
+        if len(chunk):
+            new.append(chunk)
+    if not new:
+        return []
+
+    data = ingest.prepare(ingest.concat_chunks(new))
+    data["bunched"] = aggregate.is_bunched(data, threshold)
+    dates = sorted(data["service_date"].unique())
+    # the threshold is in the file names too, so recounting the same dates under another doesn't overwrite them
+    tag = re.sub(r"[^\w.]+", "", threshold.label())
+    for route, route_data in data.groupby("route_id", observed=True):
+        outdir = route_dir(route)
+        outdir.mkdir(parents=True, exist_ok=True)
+        counts = aggregate.store_counts(route_data)
+        counts["threshold"] = threshold.label()
+        route_dates = sorted(route_data["service_date"].unique())
+        first, last = route_dates[0], route_dates[-1]
+        outname = outdir / f"{first}_{last}_{tag}.parquet"
+        suffix = 1
+        while outname.exists():
+            # a later update can fill gaps inside an earlier file's range
+            suffix += 1
+            outname = outdir / f"{first}_{last}_{tag}_{suffix}.parquet"
+        # write-then-rename, so a failed update leaves no partial file to be read as stored
+        tmp = outdir / f".{outname.name}.{os.getpid()}.tmp"
+        counts.to_parquet(tmp, index=False)
+        os.replace(tmp, outname)
+    return dates
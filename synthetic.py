@@ -0,0 +1,87 @@
+import argparse
+import datetime
+
+import numpy as np
+import pandas as pd
+
+OFFSET = np.datetime64(datetime.datetime(1900,1,1,0,0,0), "ns")
+SCHEMA = ["service_date", "route_id", "direction_id", "half_trip_id", "time_point_id", "time_point_order",
+          "scheduled", "actual", "headway", "scheduled_headway"]
+
+
+def timepoint_ids(route, n):
+    return [f"r{route}t{i:02d}" for i in range(n)]
+
+def headways(frame, column):
+    # seconds since the previous vehicle at the same timepoint on the same day
+    keys = ["service_date", "route_id", "direction_id", "time_point_id"]
+    ordered = frame.sort_values(keys + [column])
+    gaps = ordered.groupby(keys, sort=False)[column].diff().dt.total_seconds()
+    return gaps.reindex(frame.index)
+
+def generate(routes=5, trips=60, timepoints=8, days=28, start="2022-03-01",
+             headway_minutes=12, run_minutes=6, noise_seconds=90, seed=0):
+    """A frame shaped like the MBTA bus arrival/departure data.
+
+    Every route runs `trips` trips per day in each direction, from 5am at a
+    scheduled headway of `headway_minutes`, past `timepoints` timepoints
+    `run_minutes` apart. Actual times drift from schedule by a per-trip random
+    walk, which bunches some consecutive trips.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=days).strftime("%Y-%m-%d").to_numpy()
+    route_ids = np.array([str(r + 1) for r in range(routes)])
+    directions = np.array(["Inbound", "Outbound"])
+
+    shape = (routes, 2, days, trips, timepoints)
+    r, d, day, trip, tp = np.indices(shape).reshape(len(shape), -1)
+
+    minute = np.timedelta64(60, "s").astype("timedelta64[ns]")
+    scheduled = OFFSET + (5 * 60 + trip * headway_minutes + tp * run_minutes) * minute
+    drift = rng.normal(0, noise_seconds, shape).cumsum(axis=-1).reshape(-1)
+    actual = scheduled + drift.round().astype("timedelta64[s]").astype("timedelta64[ns]")
+
+    tp_names = np.array([timepoint_ids(route, timepoints) for route in route_ids])
+    # Outbound visits the timepoints in reverse
+    tp_index = np.where(d == 0, tp, timepoints - 1 - tp)
+
+    frame = pd.DataFrame({
+        "service_date": dates[day],
+        "route_id": route_ids[r],
+        "direction_id": directions[d],
+        "half_trip_id": np.ravel_multi_index((r, d, day, trip), shape[:-1]) + 1,
+        "time_point_id": tp_names[r, tp_index],
+        "time_point_order": tp + 1,
+        "scheduled": scheduled,
+        "actual": actual,
+    })
+    frame["headway"] = headways(frame, "actual")
+    frame["scheduled_headway"] = headways(frame, "scheduled")
+    return frame[SCHEMA]
+
+def checkpoints(frame):
+    ids = frame["time_point_id"].unique()
+    return pd.DataFrame({"checkpoint_id": ids, "checkpoint_name": [f"Stop {i}" for i in ids]})
+
+def write(frame, filename, checkpoint_file=None):
+    frame.to_csv(filename, index=False, date_format="%Y-%m-%d %H:%M:%S")
+    if checkpoint_file is not None:
+        checkpoints(frame).to_csv(checkpoint_file, index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="write a synthetic MBTA-shaped arrival/departure csv")
+    parser.add_argument("outname")
+    parser.add_argument("--checkpoints", help="also write a matching checkpoints.txt here")
+    parser.add_argument("--routes", type=int, default=5)
+    parser.add_argument("--trips", type=int, default=60, help="trips per day per direction")
+    parser.add_argument("--timepoints", type=int, default=8)
+    parser.add_argument("--days", type=int, default=28)
+    parser.add_argument("--start", default="2022-03-01")
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    frame = generate(args.routes, args.trips, args.timepoints, args.days, args.start, seed=args.seed)
+    write(frame, args.outname, args.checkpoints)
+    print(f"wrote {len(frame)} rows to {args.outname}")
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import aggregate
+import ingest
+import synthetic
+
+
+@pytest.fixture(scope="session")
+def month():
+    """A small synthetic month in the cache's dtypes, with some actuals missing and some rows dropped."""
+    frame = synthetic.generate(routes=3, trips=24, timepoints=6, days=14, noise_seconds=240)
+    rng = np.random.default_rng(1)
+    frame.loc[rng.random(len(frame)) < .03, "actual"] = np.datetime64("NaT")
+    frame = frame.loc[rng.random(len(frame)) > .03].reset_index(drop=True)
+    frame = ingest.prepare(frame.astype(ingest.DTYPES))
+    frame["bunched"] = aggregate.is_bunched(frame)
+    return frame
+
+
+@pytest.fixture
+def use_months(tmp_path, monkeypatch):
+    """Point draw_reports and the cache at synthetic monthly csvs under tmp_path; returns a writer."""
+    import draw_reports
+
+    monkeypatch.setattr(draw_reports, "DATAFILES", {})
+    monkeypatch.setattr(draw_reports, "CHECKPOINT_FILE", str(tmp_path / "checkpoints.txt"))
+    monkeypatch.setattr(ingest, "CACHE_DIR", tmp_path / "cache")
+    monkeypatch.chdir(tmp_path)
+    draw_reports.get_checkpoints.cache_clear()
+
+    def write(*frames):
+        for frame in frames:
+            month = frame["service_date"].iloc[0][:7]
+            draw_reports.DATAFILES[month] = str(tmp_path / f"{month}.csv")
+            synthetic.write(frame, draw_reports.DATAFILES[month])
+        synthetic.checkpoints(pd.concat(frames)).to_csv(draw_reports.CHECKPOINT_FILE, index=False)
+        return sorted(draw_reports.DATAFILES)
+    yield write
+    draw_reports.get_checkpoints.cache_clear()
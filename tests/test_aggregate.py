@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+import aggregate
+
+
+def test_wilson_bounds_contain_the_estimate_at_the_edges():
+    total = np.arange(1, 5000)
+    low, high = aggregate.wilson(np.zeros_like(total), total)
+    assert (low == 0).all() and (high > 0).all()
+    low, high = aggregate.wilson(total, total)
+    assert (high == 100).all() and (low < 100).all()
+
+def test_wilson_without_headways_is_nan():
+    low, high = aggregate.wilson([0, 3], [0, 10])
+    assert np.isnan(low[0]) and np.isnan(high[0])
+    assert low[1] < 30 < high[1]
+
+def pivot_by_hour(data, first_stop, last_stop):
+    # by_hour as it was before the array kernel, as a reference
+    bytrip = data.loc[data["time_point_id"].isin([first_stop, last_stop])]
+    bytrip = bytrip.pivot(index=["service_date", "half_trip_id"],
+                          columns="time_point_id", values=["actual", "bunched"]) \
+                   .reset_index() \
+                   .rename(columns={first_stop: "first", last_stop: "last"})
+    bytrip["departure_hour"] = (bytrip[("actual", "first")] - aggregate.OFFSET) // np.timedelta64(1, 'h')
+    bytrip = bytrip.dropna().drop("actual", axis=1, level=0)
+    bytrip["weekday"] = aggregate.weekdays(pd.to_datetime(bytrip["service_date"]))
+    bytrip.columns = [x[1] or x[0] for x in bytrip.columns]
+    molten = bytrip.melt(id_vars=["departure_hour", "weekday"], value_vars=["first", "last"],
+                         var_name="stop", value_name="bunched")
+    grouped = molten.groupby(["weekday", "departure_hour", "stop"])["bunched"]
+    percents = (grouped.sum() / grouped.count() * 100).reset_index().rename(columns={"bunched": "Percent"})
+    percents["Trip Departure Hour"] = percents["departure_hour"].astype(int)
+    percents["Stop ID"] = percents["stop"].replace({"first": first_stop, "last": last_stop})
+    return percents
+
+def visit_ends_twice(data, first_stop, last_stop, seed=3):
+    # some trips pass each end twice: later at the first stop and earlier at the last, with the other flag
+    rng = np.random.default_rng(seed)
+    seen = data["actual"].notna() & (rng.random(len(data)) < .2)
+    again = pd.concat([data.loc[seen & (data["time_point_id"] == first_stop)].assign(shift=1),
+                       data.loc[seen & (data["time_point_id"] == last_stop)].assign(shift=-1)])
+    again["actual"] += again.pop("shift") * pd.Timedelta(minutes=20)
+    again["bunched"] = ~again["bunched"]
+    return pd.concat([data, again]).sample(frac=1, random_state=seed)
+
+def one_visit_per_end(data, first_stop, last_stop):
+    # what by_hour should count: the first visit to the first stop and the last to the last
+    visits = data.sort_values("actual", kind="stable")
+    trip = ["service_date", "half_trip_id"]
+    return pd.concat([visits.loc[visits["time_point_id"] == first_stop].drop_duplicates(trip),
+                      visits.loc[visits["time_point_id"] == last_stop].drop_duplicates(trip, keep="last")])
+
+def test_by_hour_matches_the_pivot(month):
+    for (route, direction), data in month.groupby(["route_id", "direction_id"], observed=True):
+        data = data.copy()
+        data["time_point_id"] = data["time_point_id"].cat.remove_unused_categories()
+        order = data.groupby("time_point_id", observed=True)["time_point_order"].median().sort_values().index
+        first_stop, last_stop = order[1], order[-2]
+        twice = visit_ends_twice(data, first_stop, last_stop)
+        # the pivot can't take a trip seen twice at a stop, so it gets the visits by_hour should keep
+        for data, reference in [(data, data), (twice, one_visit_per_end(twice, first_stop, last_stop))]:
+            expected = pivot_by_hour(reference, first_stop, last_stop)
+            expected["Percent"] = expected["Percent"].astype(float)
+            result = aggregate.by_hour(data, first_stop, last_stop)[expected.columns]
+            pd.testing.assert_frame_equal(result, expected, check_dtype=False)
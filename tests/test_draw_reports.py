@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+import aggregate
+import draw_reports
+import ingest
+import synthetic
+
+
+def test_system_ranking_keeps_find_timepoints_less_terminals(month):
+    data = month.copy()
+    rng = np.random.default_rng(2)
+    route = (data["route_id"] == "2") & (data["direction_id"] == "Inbound")
+    # a timepoint too rare to keep, and one that sometimes shows up at another order
+    data["time_point_id"] = data["time_point_id"].cat.add_categories(["rare"])
+    data.loc[route & (rng.random(len(data)) < .01), "time_point_id"] = "rare"
+    moved = route & (data["time_point_id"] == "r2t03") & (rng.random(len(data)) < .3)
+    data.loc[moved, "time_point_order"] = 9
+
+    ranking, detail = draw_reports.system_ranking(aggregate.system_counts(data))
+    assert len(ranking) == 6
+    for (route, direction), onedir in data.groupby(["route_id", "direction_id"], observed=True):
+        expected = draw_reports.find_timepoints(onedir)["time_point_id"][1:-1]
+        kept = detail.loc[(detail["route_id"] == route) & (detail["direction_id"] == direction), "time_point_id"]
+        assert sorted(kept.unique()) == sorted(expected)
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_range_report_skips_months_without_the_route(use_months, monkeypatch, cached):
+    months = use_months(synthetic.generate(routes=2, trips=24, timepoints=5, days=7, start="2022-03-01"),
+                        synthetic.generate(routes=1, trips=24, timepoints=5, days=7, start="2022-04-01"))
+    if cached:
+        for month in months:
+            ingest.build_cache(month, draw_reports.DATAFILES[month])
+    pages = []
+    monkeypatch.setattr(draw_reports, "draw_charts", lambda *args, **kwargs: {})
+    monkeypatch.setattr(draw_reports, "add_charts_to_pdf",
+                        lambda pdf, route, direction, period, *args: pages.append((route, direction, period)))
+
+    draw_reports.generate_range_report("2", "2022-03", "2022-04", "range.pdf")
+    assert pages == [("2", direction, "March 2022 - March 2022") for direction in draw_reports.DIRECTIONS]
+    with pytest.raises(ValueError, match="no rows for route 3"):
+        draw_reports.generate_range_report("3", "2022-03", "2022-04", "range.pdf")
@@ -0,0 +1,49 @@
+import pandas as pd
+
+import episodes
+
+
+def reference_episodes(data):
+    # row by row: link each arrival to the one before it, then walk every trip's timepoints in order
+    data = data.reset_index(drop=True)
+    trip = list(zip(data["route_id"], data["service_date"], data["half_trip_id"]))
+    leader = {}
+    seen = data.loc[data["actual"].notna()].sort_values("actual", kind="stable")
+    for _, group in seen.groupby(episodes.GROUP_KEYS, observed=True, sort=False):
+        rows = list(group.index)
+        for ahead, row in zip(rows, rows[1:]):
+            leader[row] = ahead
+
+    found = []
+    ordered = data.sort_values("time_point_order", kind="stable")
+    for _, rows in ordered.groupby(["route_id", "service_date", "half_trip_id"], observed=True, sort=False):
+        current = None
+        for row in rows.index:
+            ahead = leader.get(row)
+            bunched = data.at[row, "bunched"] and ahead is not None and trip[ahead] != trip[row]
+            if bunched and current is not None and trip[current[0]] == trip[ahead]:
+                current[2] = row
+                current[3] += 1
+            else:
+                if current is not None:
+                    found.append(current)
+                current = [ahead, row, row, 1] if bunched else None
+        if current is not None:
+            found.append(current)
+
+    return pd.DataFrame({
+        "leader": [data.at[a, "half_trip_id"] for a, _, _, _ in found],
+        "follower": [data.at[f, "half_trip_id"] for _, f, _, _ in found],
+        "start_time_point": [data.at[f, "time_point_id"] for _, f, _, _ in found],
+        "end_time_point": [data.at[e, "time_point_id"] for _, _, e, _ in found],
+        "start": [data.at[f, "actual"] for _, f, _, _ in found],
+        "end": [data.at[e, "actual"] for _, _, e, _ in found],
+        "timepoints": [n for _, _, _, n in found],
+    })
+
+def test_find_matches_a_row_by_row_walk(month):
+    columns = ["leader", "follower", "start_time_point", "end_time_point", "start", "end", "timepoints"]
+    result = episodes.find(month)[columns].sort_values(["follower", "start"]).reset_index(drop=True)
+    expected = reference_episodes(month)[columns].sort_values(["follower", "start"]).reset_index(drop=True)
+    assert (result["timepoints"] > 1).any()
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_categorical=False)
@@ -0,0 +1,18 @@
+import pandas as pd
+
+import ingest
+import synthetic
+
+
+def test_arrow_stream_reads_blocks_unlike_the_first(tmp_path, monkeypatch):
+    frame = synthetic.generate(routes=1, trips=60, timepoints=4, days=3)
+    # no headways in the first block, and fractional seconds after it
+    frame["headway"] += .5
+    frame.loc[:200, ["headway", "scheduled_headway"]] = None
+    filename = tmp_path / "month.csv"
+    synthetic.write(frame, filename)
+    monkeypatch.setattr(ingest, "STREAM_BLOCK_SIZE", 4096)
+
+    streamed = ingest.concat_chunks(list(ingest.stream_routes(filename, engine="pyarrow")))
+    expected = ingest.concat_chunks(list(ingest.stream_routes(filename, engine="pandas")))
+    pd.testing.assert_frame_equal(streamed, expected, check_categorical=False, check_like=True)
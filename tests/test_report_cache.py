@@ -0,0 +1,19 @@
+import pytest
+
+import draw_reports
+import ingest
+import synthetic
+
+
+@pytest.mark.parametrize("stream", ["pandas", "pyarrow"])
+def test_report_key_is_the_same_however_the_route_is_loaded(use_months, stream):
+    month, = use_months(synthetic.generate(routes=2, trips=12, timepoints=4, days=3))
+    loaded = {
+        "csv": draw_reports.load_data(month, "1"),
+        "stream": draw_reports.load_data(month, "1", stream),
+        "split": dict(ingest.split_routes(draw_reports.DATAFILES[month], engine=stream))["1"],
+    }
+    ingest.build_cache(month, draw_reports.DATAFILES[month])
+    loaded["cache"] = draw_reports.load_data(month, "1")
+    keys = {path: draw_reports.report_key(data) for path, data in loaded.items()}
+    assert len(set(keys.values())) == 1, keys
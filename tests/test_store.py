@@ -0,0 +1,29 @@
+import pandas as pd
+import pytest
+
+import draw_reports
+import ingest
+import store
+import synthetic
+
+
+def test_update_merges_routes_left_over_from_a_failed_update(use_months, monkeypatch):
+    month, = use_months(synthetic.generate(routes=2, trips=12, timepoints=4, days=3))
+    monkeypatch.setattr(store, "STORE_DIR", ingest.CACHE_DIR / "aggregates")
+    to_parquet = pd.DataFrame.to_parquet
+
+    def fail_on_route_2(counts, path, *args, **kwargs):
+        if "route_id=2" in str(path):
+            raise OSError("disk full")
+        return to_parquet(counts, path, *args, **kwargs)
+
+    with monkeypatch.context() as patched:
+        patched.setattr(pd.DataFrame, "to_parquet", fail_on_route_2)
+        with pytest.raises(OSError):
+            store.update(draw_reports.DATAFILES[month])
+    assert not list(store.route_dir("2").glob("*"))
+
+    assert store.update(draw_reports.DATAFILES[month]) == ["2022-03-01", "2022-03-02", "2022-03-03"]
+    assert store.update(draw_reports.DATAFILES[month]) == []
+    for route in ["1", "2"]:
+        assert sorted(store.read(route)["service_date"].unique()) == ["2022-03-01", "2022-03-02", "2022-03-03"]